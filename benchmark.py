@@ -0,0 +1,283 @@
+"""Timing benchmarks for the Trends project.
+
+Usage:
+  python3 benchmark.py draw [--backend tk]   (the tk backend needs a display)
+  python3 benchmark.py filter [--term love]
+  python3 benchmark.py pipeline [--tweets 1000000] [--json results.json]
+  python3 benchmark.py distance [--tweets 100000]
+  python3 benchmark.py scoring
+
+Each benchmark is a generator of (label, seconds, note) results.  As each
+result is yielded, the peak resident memory of the process so far is read.
+That high-water mark only rises, so it is cumulative rather than the peak of
+one stage: a stage that needs more memory than any before it raises it, and
+other stages leave it unchanged.  --json saves the results so that runs can
+be compared.
+"""
+
+import io
+import json
+import os
+import platform
+import re
+import sys
+import time
+from ucb import main
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def best_time(fn, repeat, setup=None):
+    """Return the smallest wall-clock time in seconds over repeat calls to fn,
+    calling setup (if given) untimed before each one."""
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def peak_rss():
+    """Return the peak resident memory of this process so far in megabytes,
+    or None where it cannot be measured."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / (1 << 10)
+
+def bench_draw(args):
+    """Time drawing every U.S. state polygon one at a time and in one batch."""
+    import maps
+    from geo import us_states, position_to_xy
+    maps.set_backend(args.backend or 'tk')
+    canvas = maps.get_canvas()
+    states = [(shapes, 0) for shapes in us_states.values()]
+    color = maps.get_sentiment_color(0)
+
+    def one_at_a_time():
+        canvas.clear()
+        for shapes, _ in states:
+            for polygon in shapes:
+                vertices = [position_to_xy(position) for position in polygon]
+                canvas.draw_polygon(vertices, fill_color=color)
+
+    def batched():
+        canvas.clear()
+        maps.draw_states(states)
+
+    polygons = sum(len(shapes) for shapes, _ in states)
+    shapes = '{0} shapes'.format(polygons)
+    yield ('one shape per call', best_time(one_at_a_time, args.repeat), shapes)
+    yield ('single batch', best_time(batched, args.repeat), shapes)
+
+def bench_filter(args):
+    """Time scanning each bundled tweets file for a term, decoding every line
+    versus prefiltering raw bytes, and check that both find the same lines."""
+    import data
+    term = args.term.lower()
+    pattern = re.compile('\\W' + term + '\\W', flags=re.IGNORECASE)
+    for path in data.bundled_tweets_paths():
+        raw = open(path, 'rb').read()
+        megabytes = len(raw) / 1e6
+        found = {}
+
+        def text_scan():
+            stream = io.TextIOWrapper(io.BytesIO(raw), encoding='utf8')
+            found['text'] = list(data._text_matching_lines(stream, term, pattern))
+
+        def bytes_scan():
+            found['bytes'] = list(data.matching_lines(io.BytesIO(raw), term, pattern))
+
+        text_time = best_time(text_scan, args.repeat)
+        bytes_time = best_time(bytes_scan, args.repeat)
+        assert found['text'] == found['bytes'], 'Filtered lines differ for ' + path
+        name = os.path.basename(path)
+        yield (name + ' text', text_time, '{0:.1f} MB/s'.format(megabytes / text_time))
+        yield (name + ' bytes', bytes_time, '{0:.1f} MB/s'.format(megabytes / bytes_time))
+
+def bench_distance(args):
+    """Time great circle distances from tweet locations to every state center,
+    one pair at a time and vectorized, and report how far the vectorized
+    distances and nearest centers are from those of geo_distance.  They are
+    identical where NumPy's sin and cos match the C library's."""
+    import geo
+    import trends
+    import synthetic
+    import random
+    rng = random.Random(0)
+    pool = synthetic.location_pool(rng, 4096)
+    count = args.tweets or 10000
+    positions = [tuple(json.loads(rng.choice(pool))) for _ in range(count)]
+    centers = list(trends.state_centers().values())
+    pairs = count * len(centers)
+    found = {}
+
+    def one_pair_at_a_time():
+        found['scalar'] = [[geo.geo_distance(p, c) for c in centers] for p in positions]
+
+    def many():
+        found['many'] = [geo.geo_distance_many(p, centers) for p in positions]
+
+    def matrix():
+        found['matrix'] = geo.distance_matrix(positions, centers)
+
+    for label, name, fn in (('geo_distance', 'scalar', one_pair_at_a_time),
+                            ('geo_distance_many', 'many', many), ('distance_matrix', 'matrix', matrix)):
+        seconds = best_time(fn, args.repeat)
+        note = '{0:.0f} ns per pair'.format(seconds / pairs * 1e9)
+        if name != 'scalar':
+            difference = max(abs(d - e) for row, expected in zip(found[name], found['scalar'])
+                             for d, e in zip(row, expected))
+            note += ', differs from geo_distance by at most {0:.3g} miles'.format(difference)
+        yield (label, seconds, note)
+    seconds = best_time(lambda: found.update(nearest=geo.nearest(positions, centers)), args.repeat)
+    expected = [min(range(len(centers)), key=row.__getitem__) for row in found['scalar']]
+    differing = sum(i != j for i, j in zip(found['nearest'], expected))
+    yield ('nearest', seconds, '{0:.0f} ns per pair, {1} of {2} differ from geo_distance'.format(
+        seconds / pairs * 1e9, differing, count))
+
+def bench_scoring(args):
+    """Time scoring every bundled tweet by single words and by phrases with
+    negation, including compiling the phrase automaton once."""
+    import data
+    import trends
+    tweets = [trends.make_tweet(fields[3].lower(), None, fields[0], fields[1])
+              for fields in map(data.split_tweet_line, bundled_lines())]
+    words = sum(len(trends.tweet_words(tweet)) for tweet in tweets)
+    seconds = best_time(lambda: trends.PhraseAutomaton(trends.sentiment_lexicon()), args.repeat)
+    yield ('compile phrase automaton', seconds, '{0} entries'.format(len(trends.phrase_automaton())))
+    for mode, name in sorted(trends.SCORERS.items(), reverse=True):
+        score, found = getattr(trends, name), {}
+        seconds = best_time(lambda: found.update(scores=[score(t) for t in tweets]), args.repeat)
+        scored = sum(trends.has_sentiment(s) for s in found['scores'])
+        yield ('score by ' + mode, seconds, '{0:.0f} tweets/s, {1:.0f} words/s, {2} of {3} scored'.format(
+            len(tweets) / seconds, words / seconds, scored, len(tweets)))
+
+CORPUS_NAME = 'benchmark-corpus.txt'
+
+def bundled_lines():
+    """Return the lines of all bundled tweets files (not those filtered from
+    them by earlier queries)."""
+    import data
+    lines = []
+    for path in data.bundled_tweets_paths():
+        with open(path, encoding='utf8') as tweets:
+            lines.extend(line for line in tweets if data.split_tweet_line(line))
+    return lines
+
+def write_corpus(path, tweets):
+    """Write an unfiltered tweets file to path and return its tweet count.
+
+    The file holds the bundled tweets if tweets is 0, and otherwise that many
+    synthetic tweets (see synthetic.py).
+    """
+    if tweets:
+        import synthetic
+        synthetic.generate_corpus(path, tweets)
+        return tweets
+    lines = bundled_lines()
+    with open(path, mode='w', encoding='utf8') as out:
+        out.writelines(lines)
+    return len(lines)
+
+def bench_pipeline(args):
+    """Time each stage of mapping the sentiment of a term, from loading data
+    files to drawing the map with a headless backend."""
+    import data
+    import geo
+    import maps
+    import trends
+    term = args.term.lower()
+    corpus_path = data.DATA_PATH + CORPUS_NAME
+    filtered_path = data.DATA_PATH + data.file_name_for_term(term, CORPUS_NAME)
+    generated = [corpus_path, filtered_path, filtered_path + '.done', filtered_path + '.lock']
+    try:
+        count = write_corpus(corpus_path, args.tweets)
+        megabytes = os.path.getsize(corpus_path) / 1e6
+
+        def stage(label, fn, items, unit, setup=None):
+            seconds = best_time(fn, args.repeat, setup)
+            rate = '{0:.0f} {1}/s'.format(items / seconds, unit) if seconds else unit
+            return label, seconds, rate
+
+        def remove_filtered():
+            for path in generated[1:3]:
+                if os.path.exists(path):
+                    os.remove(path)
+
+        yield stage('load_sentiments', data.load_sentiments, 1, 'lexicons')
+        yield stage('load_states', geo.load_states, 1, 'maps')
+        yield stage('generate_filtered_file', lambda: data.generate_filtered_file(CORPUS_NAME, term),
+              megabytes, 'MB', setup=remove_filtered)
+        data.generate_filtered_file(CORPUS_NAME, term)
+        found = {}
+        load = lambda: found.update(tweets=data.load_tweets(trends.make_tweet, term, CORPUS_NAME))
+        yield stage('load_tweets', load, sum(1 for _ in open(filtered_path, encoding='utf8')), 'tweets')
+        tweets = found['tweets']
+        texts = [trends.tweet_text(tweet) for tweet in tweets]
+        yield stage('extract_words', lambda: [trends.extract_words(t) for t in texts], len(texts), 'tweets')
+        yield stage('analyze_tweet_sentiment', lambda: [trends.analyze_tweet_sentiment(t) for t in tweets],
+              len(tweets), 'tweets')
+        states = list(geo.us_states.values())
+        yield stage('find_state_center', lambda: [trends.find_state_center(s) for s in states],
+              len(states), 'states')
+        yield stage('group_tweets_by_state', lambda: found.update(groups=trends.group_tweets_by_state(tweets)),
+              len(tweets), 'tweets')
+        groups = {}
+        copy_groups = lambda: groups.update({k: list(v) for k, v in found['groups'].items()})
+        yield stage('average_sentiments', lambda: trends.average_sentiments(groups), len(tweets), 'tweets',
+              setup=copy_groups)
+        result = trends.analyze_query(term, CORPUS_NAME, use_cache=False)
+        maps.set_backend(args.backend or 'png')
+
+        def draw():
+            trends.draw_state_sentiments(result['state_sentiments'])
+            maps.clear_dots()
+            maps.draw_dots([geo.make_position(lat, lon) for lat, lon, _ in result['dots']],
+                           [value for _, _, value in result['dots']])
+        backend = args.backend or 'png'
+        yield stage('draw ({0} backend)'.format(backend), draw, len(result['dots']), 'dots',
+                    setup=maps.clear_map)
+        yield stage('recolor ({0} backend)'.format(backend), draw, len(result['dots']), 'dots')
+        yield ('corpus', 0, '{0} tweets, {1:.1f} MB'.format(count, megabytes))
+    finally:
+        for path in generated:
+            if os.path.exists(path):
+                os.remove(path)
+
+BENCHMARKS = {'draw': bench_draw, 'filter': bench_filter, 'pipeline': bench_pipeline,
+              'distance': bench_distance, 'scoring': bench_scoring}
+
+@main
+def run(*args):
+    """Run the benchmark named on the command line and print its results."""
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark Trends")
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--backend', '-b', type=str,
+                        help='Canvas backend (tk for draw, png for pipeline by default)')
+    parser.add_argument('--repeat', '-r', type=int, default=5)
+    parser.add_argument('--term', '-m', type=str, default='love')
+    parser.add_argument('--tweets', '-n', type=int, default=0,
+                        help='Benchmark the pipeline on this many synthetic tweets '
+                             'instead of the bundled tweets (or distances from this many)')
+    parser.add_argument('--json', '-j', type=str,
+                        help='Save the results to this JSON file')
+    args = parser.parse_args()
+    report = {'benchmark': args.benchmark, 'arguments': vars(args),
+              'python': platform.python_version(), 'platform': platform.platform(),
+              'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'results': []}
+    for label, seconds, note in BENCHMARKS[args.benchmark](args):
+        rss = peak_rss()  # The peak so far, read as soon as the measurement is yielded
+        memory = '' if rss is None else '  {0:7.1f} MB peak so far'.format(rss)
+        print('{0:>36}: {1:9.2f} ms{2}  ({3})'.format(label, seconds * 1000, memory, note))
+        report['results'].append({'label': label, 'seconds': seconds, 'note': note,
+                                  'peak_rss_so_far_mb': rss})
+    report['peak_rss_mb'] = peak_rss()
+    if args.json:
+        with open(args.json, mode='w', encoding='utf8') as out:
+            json.dump(report, out, indent=2)
@@ -0,0 +1,115 @@
+"""An on-disk cache of query results with least-recently-used eviction.
+
+Each result is stored as a JSON file named by a hash of its key, which
+combines the query term, the tweets file with its size and modification time,
+and a hash of the sentiment lexicon.  Changing any of them makes old results
+unreachable, and the least recently used results are deleted whenever the
+cache grows beyond its size limit.
+"""
+
+import hashlib
+import json
+import os
+from data import DATA_PATH, file_name_for_term
+from query import canonical_term, is_query, scan_path
+
+CACHE_PATH = DATA_PATH + 'results' + os.sep
+MAX_CACHE_BYTES = 64 * 1024 * 1024
+
+_lexicon_hash = []
+
+def lexicon_hash():
+    """Return a hash of the sentiment lexicon file, computed once.  The file
+    is hashed rather than data.word_sentiments, so that processes using a
+    compact lexicon do not load the dictionary."""
+    if not _lexicon_hash:
+        with open(DATA_PATH + 'sentiments.csv', mode='rb') as lexicon_file:
+            _lexicon_hash.append(hashlib.sha1(lexicon_file.read()).hexdigest())
+    return _lexicon_hash[0]
+
+def corpus_fingerprint(term, file_name):
+    """Return the size and modification time of the tweets file for a query.
+
+    A query (see query.py) is keyed on the file that it scans, which may be a
+    filtered file.  If the unfiltered tweets file for a plain term does not
+    exist, the filtered file for term stands in for it.
+    """
+    if is_query(term):
+        path = scan_path(term, file_name)
+    else:
+        path = DATA_PATH + file_name
+    if not os.path.exists(path):
+        path = DATA_PATH + file_name_for_term(term.lower(), file_name)
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+def result_key(term, file_name):
+    """Return the cache key for the result of querying term in file_name."""
+    return [canonical_term(term), file_name, corpus_fingerprint(term, file_name), lexicon_hash()]
+
+def _entry_path(key):
+    digest = hashlib.sha1(json.dumps(key).encode('utf8')).hexdigest()
+    return CACHE_PATH + digest + '.json'
+
+def load_result(key):
+    """Return the cached result for key, or None if there is none."""
+    path = _entry_path(key)
+    try:
+        with open(path, encoding='utf8') as entry:
+            stored = json.load(entry)
+    except (OSError, ValueError):
+        return None
+    if stored.get('key') != key:
+        return None
+    try:
+        os.utime(path)  # Mark the entry as recently used
+    except OSError:
+        pass  # Another process evicted the entry after it was read
+    return stored['result']
+
+def save_result(key, result, max_bytes=MAX_CACHE_BYTES):
+    """Store a JSON-serializable result under key, then evict the least
+    recently used entries until the cache fits in max_bytes."""
+    os.makedirs(CACHE_PATH, exist_ok=True)
+    path = _entry_path(key)
+    temp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+    with open(temp_path, mode='w', encoding='utf8') as entry:
+        json.dump({'key': key, 'result': result}, entry)
+    os.replace(temp_path, path)
+    evict(max_bytes)
+
+def evict(max_bytes=MAX_CACHE_BYTES):
+    """Delete least recently used entries until the cache fits in max_bytes.
+
+    >>> import cache, tempfile
+    >>> saved_path, cache.CACHE_PATH = CACHE_PATH, tempfile.mkdtemp() + os.sep
+    >>> load_result(['old']) is None  # A miss
+    True
+    >>> save_result(['old'], {'tweets': 1})
+    >>> load_result(['old'])  # A hit
+    {'tweets': 1}
+    >>> os.utime(_entry_path(['old']), (1, 1))  # Last used long ago
+    >>> save_result(['new'], {'tweets': 2}, max_bytes=60)  # Evicts the old entry
+    >>> load_result(['old']), load_result(['new'])
+    (None, {'tweets': 2})
+    >>> cache.CACHE_PATH = saved_path
+    """
+    entries = []
+    for name in os.listdir(CACHE_PATH):
+        if name.endswith('.json'):
+            try:
+                stat = os.stat(CACHE_PATH + name)
+            except OSError:
+                continue  # Another process evicted the entry
+            entries.append((stat.st_mtime, stat.st_size, CACHE_PATH + name))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
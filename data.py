@@ -1,12 +1,26 @@
 """Functions for reading data from the sentiment dictionary and tweet files."""
 
+import bz2
+import gzip
+import io
+import json
+import lzma
+import mmap
 import os
 import re
 import string
 import sys
+from contextlib import contextmanager
 from datetime import datetime
+from instrument import stage, count
+from progress import Progress, LINES_PER_UPDATE
 from ucb import main, interact
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Concurrent builds are not coalesced without file locks
+
 # Look for data directory
 PY_PATH = sys.argv[0]
 if PY_PATH.endswith('doctest.py') and len(sys.argv) > 1:
@@ -25,31 +39,268 @@ def load_sentiments(file_name=DATA_PATH + "sentiments.csv"):
         sentiments[word] = float(score.strip())
     return sentiments
 
-word_sentiments = load_sentiments()
+def __getattr__(name):
+    """Load word_sentiments, the dictionary of sentiment scores, when it is
+    first used, so that a process that looks up sentiments in a compact
+    lexicon (see lexicon.py) never builds it."""
+    if name == 'word_sentiments':
+        global word_sentiments
+        word_sentiments = load_sentiments()
+        return word_sentiments
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
+
+# The filtered tweets files distributed in the data directory.  Files that
+# queries filter from them have names of the same form, so they are listed
+# rather than found by pattern.
+BUNDLED_TWEETS_FILES = ('my_life_tweets2011.txt', 'obama_tweets2011.txt',
+                        'party_tweets2011.txt', 'sandwich_tweets2011.txt',
+                        'soup_tweets2011.txt', 'texas_tweets2011.txt')
+
+def bundled_tweets_paths():
+    """Return the paths of the bundled tweets files that are present."""
+    paths = [DATA_PATH + name for name in BUNDLED_TWEETS_FILES]
+    return [path for path in paths if os.path.exists(path)]
+
+# Tweets files with these extensions are decompressed as they are read
+COMPRESSED_OPENERS = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+READ_BUFFER_SIZE = 1 << 20
+SCAN_BLOCK_SIZE = 1 << 22
+PROGRESS_SAMPLE_SIZE = 1 << 16
+
+# The only non-ASCII characters whose lowercase forms contain ASCII letters,
+# encoded as UTF-8; bytes.lower() cannot fold them
+_ASCII_FOLDING = ('\u0130'.encode('utf8'), '\u212a'.encode('utf8'))
+
+def open_corpus(path, binary=False):
+    """Open a tweets file for reading, decompressing .gz, .bz2, and .xz files
+    as a stream through a large read buffer.
+
+    Returns a text stream that decodes UTF-8 with universal newlines, like
+    open(path, encoding='utf8'), or a binary stream if binary is true.
+    """
+    opener = COMPRESSED_OPENERS.get(os.path.splitext(path)[1])
+    if opener is None:
+        stream = open(path, mode='rb', buffering=READ_BUFFER_SIZE)
+    else:
+        stream = io.BufferedReader(opener(path, mode='rb'), READ_BUFFER_SIZE)
+    if binary:
+        return stream
+    return io.TextIOWrapper(stream, encoding='utf8')
 
 def file_name_for_term(term, unfiltered_name):
-    """Return a valid filename that corresponds to an arbitrary term string."""
+    """Return a valid filename that corresponds to an arbitrary term string.
+
+    Filtered files are uncompressed, so a compression extension is dropped.
+
+    >>> file_name_for_term('my job', 'tweets2011.txt.gz')
+    'my_job_tweets2011.txt'
+    """
     valid_characters = '-_' + string.ascii_letters + string.digits
     no_space = term.replace(' ', '_')
+    root, extension = os.path.splitext(unfiltered_name)
+    if extension in COMPRESSED_OPENERS:
+        unfiltered_name = root
     return ''.join(c for c in no_space if c in valid_characters) + '_' +  unfiltered_name
 
-def generate_filtered_file(unfiltered_name, term):
+def generate_filtered_file(unfiltered_name, term, progress=None):
     """Return the path to a file containing tweets that match term, generating
     that file if necessary.
+
+    The file is written under a temporary name and renamed into place when it
+    is complete, and a lock file ensures that concurrent processes asking for
+    the same term build it only once.
+
+    progress -- an optional callback that receives a status dictionary (see
+                progress.Progress) periodically while the file is generated
     """
     filtered_path = DATA_PATH + file_name_for_term(term, unfiltered_name)
-    if not os.path.exists(filtered_path):
+    unfiltered_path = DATA_PATH + unfiltered_name
+    if is_complete(filtered_path, unfiltered_path):
+        return filtered_path
+    with locked(filtered_path + '.lock'):
+        if is_complete(filtered_path, unfiltered_path):
+            return filtered_path  # Another process built it while we waited
         print('Generating filtered tweets file for "{0}" using tweets from {1}.'.format(term, unfiltered_name))
         r = re.compile('\W' + term + '\W', flags=re.IGNORECASE)
-        with open(filtered_path, mode='w', encoding='utf8') as out:
-            unfiltered = open(DATA_PATH + unfiltered_name, encoding='utf8')
-            matches = [l for l in unfiltered if term in l.lower()]
-            for line in matches:
-                if r.search(line):
-                    out.write(line)
+        temp_path = '{0}.{1}.tmp'.format(filtered_path, os.getpid())
+        meter = progress and Progress('Filtering for "{0}"'.format(term), progress,
+                                      scan_size(unfiltered_path))
+        try:
+            with open(temp_path, mode='w', encoding='utf8') as out:
+                with open_corpus(unfiltered_path, binary=True) as unfiltered:
+                    for line in matching_lines(unfiltered, term, r, meter):
+                        out.write(line)
+                        if meter:
+                            meter.matches += 1
+            os.replace(temp_path, filtered_path)
+            if meter:
+                meter.finish()
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        write_atomically(filtered_path + '.done', source_fingerprint(unfiltered_path))
     return filtered_path
 
-def load_tweets(make_tweet, term='my job', file_name='tweets2011.txt'):
+def matching_lines(stream, term, pattern, progress=None):
+    """Yield the lines of a binary stream that contain term (compared with
+    each lowercased line) and match the compiled regular expression pattern.
+
+    Lines are yielded as text, exactly as they would be read from a text
+    stream.  The stream is scanned in large blocks: each block is lowercased
+    as bytes and searched for term, and only the lines around each hit are
+    decoded and checked against pattern.
+
+    progress -- an optional Progress, updated after each block is read; lines
+                are counted in a sample of each block to keep updates cheap
+
+    >>> stream = io.BytesIO(b'Good soup\\nbad soup\\nsoup\\n')
+    >>> list(matching_lines(stream, 'good', re.compile('soup')))
+    ['Good soup\\n']
+    >>> list(matching_lines(io.BytesIO(b'Good soup\\nno\\n'), '', re.compile('soup')))
+    ['Good soup\\n']
+    """
+    try:
+        needle = term.encode('ascii')
+    except UnicodeEncodeError:
+        needle = b''  # A term that bytes cannot contain
+    if not needle:
+        # Every line contains an empty term, so only pattern decides
+        yield from _text_matching_lines(io.TextIOWrapper(stream, encoding='utf8'), term, pattern)
+        return
+    tail = b''
+    while True:
+        chunk = stream.read(SCAN_BLOCK_SIZE)
+        if progress and chunk:
+            sample = chunk[:PROGRESS_SAMPLE_SIZE]
+            progress.update(bytes=progress.bytes + len(chunk), lines=progress.lines +
+                            len(chunk) * sample.count(b'\n') // len(sample))
+        if chunk:
+            data = tail + chunk
+            end = data.rfind(b'\n') + 1
+            block, tail = data[:end], data[end:]
+        else:
+            block, tail = tail, b''
+        if block:
+            yield from _block_matching_lines(block, needle, term, pattern)
+        if not chunk:
+            return
+
+def _block_matching_lines(block, needle, term, pattern):
+    """Yield the matching lines of a block of whole lines."""
+    if b'\r' in block or any(s in block for s in _ASCII_FOLDING):
+        # Lines that need text newline translation or Unicode case folding
+        text = io.StringIO(block.decode('utf8'), newline=None)
+        yield from _text_matching_lines(text, term, pattern)
+        return
+    lower = block.lower()
+    position = lower.find(needle)
+    while position != -1:
+        start = lower.rfind(b'\n', 0, position) + 1
+        end = lower.find(b'\n', position) + 1 or len(block)
+        line = block[start:end].decode('utf8')
+        if pattern.search(line):
+            yield line
+        position = lower.find(needle, end)
+
+def _text_matching_lines(lines, term, pattern):
+    """Yield the lines of a text stream that contain term and match pattern."""
+    for line in lines:
+        if term in line.lower() and pattern.search(line):
+            yield line
+
+def scan_size(path):
+    """Return the number of bytes a scan of path reads, or None if it is
+    compressed and the size of its contents is unknown."""
+    if os.path.splitext(path)[1] in COMPRESSED_OPENERS:
+        return None
+    return os.path.getsize(path)
+
+def source_fingerprint(path):
+    """Return a string identifying the size and modification time of a file."""
+    stat = os.stat(path)
+    return '{0} {1}\n'.format(stat.st_size, stat.st_mtime_ns)
+
+def is_complete(filtered_path, unfiltered_path):
+    """Return whether filtered_path was completely generated from the current
+    contents of unfiltered_path.
+
+    A completed file has a .done marker that records the size and modification
+    time of its source.  A filtered file without a source to compare against
+    (such as those distributed in the data directory) is trusted as it is.
+    """
+    if not os.path.exists(filtered_path):
+        return False
+    if not os.path.exists(unfiltered_path):
+        return True
+    try:
+        with open(filtered_path + '.done', encoding='utf8') as marker:
+            return marker.read() == source_fingerprint(unfiltered_path)
+    except OSError:
+        return False
+
+def write_atomically(path, text):
+    """Write text (or bytes) to path so that readers see either the old or
+    new contents."""
+    temp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+    if isinstance(text, bytes):
+        out = open(temp_path, mode='wb')
+    else:
+        out = open(temp_path, mode='w', encoding='utf8')
+    with out:
+        out.write(text)
+    os.replace(temp_path, path)
+
+MAPPED_HEADER_SIZE = 1024  # bytes of JSON, padded with spaces, before the contents
+
+def _mapped_fingerprint(source_path):
+    stat = os.stat(source_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+def save_mapped_file(path, header, contents, source_path):
+    """Write a padded JSON header, which records the size and modification
+    time of source_path, followed by the bytes of contents to path."""
+    header = dict(header, fingerprint=_mapped_fingerprint(source_path))
+    text = json.dumps(header).encode('utf8')
+    assert len(text) < MAPPED_HEADER_SIZE, 'Header is too long for ' + path
+    write_atomically(path, text.ljust(MAPPED_HEADER_SIZE) + contents)
+
+def load_mapped_file(path, source_path, build):
+    """Return a (header, buffer) pair for a file written by save_mapped_file,
+    with the file memory-mapped as the buffer and header['offset'] the
+    position of its contents.
+
+    If the file is missing, or source_path has changed since it was written,
+    it is written first from build(), which returns a (header, contents) pair.
+    Memory-mapped files are shared by every process that maps them.
+    """
+    header = None
+    if os.path.exists(path):
+        with open(path, mode='rb') as mapped_file:
+            header = json.loads(mapped_file.read(MAPPED_HEADER_SIZE).decode('utf8'))
+        if header.get('fingerprint') != _mapped_fingerprint(source_path):
+            header = None
+    if header is None:
+        header, contents = build()
+        save_mapped_file(path, header, contents, source_path)
+    with open(path, mode='rb') as mapped_file:
+        buffer = mmap.mmap(mapped_file.fileno(), 0, access=mmap.ACCESS_READ)
+    return dict(header, offset=MAPPED_HEADER_SIZE), buffer
+
+@contextmanager
+def locked(lock_path):
+    """Hold an exclusive lock on lock_path, waiting for other processes."""
+    if fcntl is None:
+        yield
+        return
+    with open(lock_path, mode='a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def load_tweets(make_tweet, term='my job', file_name='tweets2011.txt',
+                bbox=None, start=None, end=None, progress=None):
     """Return the list of tweets in file_name that contain term.
 
     make_tweet -- a constructor that takes four arguments:
@@ -57,15 +308,162 @@ def load_tweets(make_tweet, term='my job', file_name='tweets2011.txt'):
       - a datetime.datetime object representing the time of the tweet
       - a longitude coordinate
       - a latitude coordinate
+    bbox -- optional (south, west, north, east) bounds; only tweets inside
+            them are returned
+    start, end -- optional datetime objects; only tweets posted between them
+                  (inclusive) are returned
+    progress -- an optional callback for progress reports, as for
+                generate_filtered_file
+    """
+    return list(iter_tweets(make_tweet, term, file_name, bbox, start, end, progress))
+
+def iter_tweets(make_tweet, term='my job', file_name='tweets2011.txt',
+                bbox=None, start=None, end=None, progress=None):
+    """Yield the tweets in file_name that contain term, as for load_tweets.
+
+    The bbox and time bounds are checked on the raw fields of each line
+    before its time is parsed or a tweet is made.  For a block-indexed corpus
+    (see compress_corpus) without a filtered file for term, blocks whose
+    recorded extent lies outside the bounds are skipped entirely.
     """
     term = term.lower()
-    filtered_path = generate_filtered_file(file_name, term)
-    tweets = []
-    for line in open(filtered_path, encoding='utf8'):
-        if len(line.strip().split("\t")) >=4:
-            loc, _, time_text, text = line.strip().split("\t")
-            time = datetime.strptime(time_text, '%Y-%m-%d %H:%M:%S')
-            lat, lon = eval(loc)
-            tweet = make_tweet(text.lower(), time, lat, lon)
-            tweets.append(tweet)
-    return tweets
+    start_text = start and start.strftime(TIME_FORMAT)
+    end_text = end and end.strftime(TIME_FORMAT)
+    lines = parsed = 0
+    meter = progress and Progress('Loading tweets for "{0}"'.format(term), progress)
+    try:
+        for line in _term_lines(term, file_name, bbox, start_text, end_text, meter):
+            lines += 1
+            if meter and not lines % LINES_PER_UPDATE:
+                meter.update(lines=lines, matches=parsed)
+            fields = split_tweet_line(line)
+            if fields is None:
+                continue
+            lat, lon, time_text, text = fields
+            if start_text and time_text < start_text or end_text and time_text > end_text:
+                continue
+            if bbox and not (bbox[0] <= lat <= bbox[2] and bbox[1] <= lon <= bbox[3]):
+                continue
+            time = datetime.strptime(time_text, TIME_FORMAT)
+            parsed += 1
+            yield make_tweet(text.lower(), time, lat, lon)
+        if meter:
+            meter.update(lines=lines, matches=parsed)
+            meter.finish()
+    finally:
+        count('tweets parsed', parsed)
+        count('tweets dropped', lines - parsed)
+
+def _term_lines(term, file_name, bbox, start_text, end_text, meter=None):
+    """Yield the lines of file_name that contain term, keeping the byte
+    counts of meter (a Progress, if given) up to date."""
+    unfiltered_path = DATA_PATH + file_name
+    filtered_path = DATA_PATH + file_name_for_term(term, file_name)
+    bounded = bbox or start_text or end_text
+    if (bounded and os.path.exists(unfiltered_path + '.idx') and
+            not is_complete(filtered_path, unfiltered_path)):
+        r = re.compile('\W' + term + '\W', flags=re.IGNORECASE)
+        if meter:
+            meter.restart(os.path.getsize(unfiltered_path))
+        for block in corpus_blocks(unfiltered_path):
+            if block_overlaps(block, bbox, start_text, end_text):
+                lines = read_corpus_block(unfiltered_path, block)
+                yield from _text_matching_lines(lines, term, r)
+            if meter:
+                meter.bytes = block['offset'] + block['length']
+    else:
+        with stage('filter corpus'):
+            filtered_path = generate_filtered_file(file_name, term, meter and meter.callback)
+        with open_corpus(filtered_path) as lines:
+            if meter:
+                meter.restart(scan_size(filtered_path))
+                meter.position = lines.buffer.tell
+            yield from lines
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+def split_tweet_line(line):
+    """Return the (latitude, longitude, time text, text) fields of a line of a
+    tweets file, or None if the line does not have all of them.
+
+    >>> split_tweet_line('[38.5, -122.25]\\t6\\t2011-08-28 19:03:01\\tHi there\\n')
+    (38.5, -122.25, '2011-08-28 19:03:01', 'Hi there')
+    """
+    fields = line.strip().split('\t', 3)
+    if len(fields) < 4:
+        return None
+    loc, _, time_text, text = fields
+    lat, lon = loc.strip('[] ').split(',')
+    return float(lat), float(lon), time_text, text
+
+def compress_corpus(path, blocked_path, lines_per_block=100000):
+    """Write the tweets file at path as a block-indexed gzip file.
+
+    Each block of lines_per_block lines is compressed as its own gzip member,
+    so the result is an ordinary .gz file that open_corpus can stream.  The
+    byte range of each member is recorded in blocked_path + '.idx', which lets
+    read_corpus_block decompress any block without reading the ones before it.
+    The index also records the time range and bounding box of the tweets in
+    each block, so that bounded scans can skip blocks.  Corpora sorted by time
+    give blocks with narrow time ranges.
+    """
+    index = []
+    with open_corpus(path, binary=True) as source, open(blocked_path, 'wb') as out:
+        lines = []
+        for line in source:
+            lines.append(line)
+            if len(lines) == lines_per_block:
+                index.append(_write_block(out, lines))
+                lines = []
+        if lines:
+            index.append(_write_block(out, lines))
+    write_atomically(blocked_path + '.idx', json.dumps(index))
+
+def _write_block(out, lines):
+    offset = out.tell()
+    out.write(gzip.compress(b''.join(lines)))
+    block = {'offset': offset, 'length': out.tell() - offset, 'lines': len(lines)}
+    fields = [split_tweet_line(line.decode('utf8')) for line in lines]
+    fields = [f for f in fields if f is not None]
+    if fields:
+        lats, lons, times = [f[0] for f in fields], [f[1] for f in fields], [f[2] for f in fields]
+        block.update(start=min(times), end=max(times), south=min(lats),
+                     west=min(lons), north=max(lats), east=max(lons))
+    return block
+
+def block_overlaps(block, bbox=None, start_text=None, end_text=None):
+    """Return whether a block of a block-indexed corpus may hold tweets inside
+    bbox and between the time texts start_text and end_text.
+
+    >>> block = {'start': '2011-09-01 00:00:00', 'end': '2011-09-02 00:00:00',
+    ...          'south': 30, 'west': -100, 'north': 35, 'east': -90}
+    >>> block_overlaps(block, (36, -100, 40, -90))
+    False
+    >>> block_overlaps(block, start_text='2011-09-01 12:00:00')
+    True
+    """
+    if 'start' not in block:
+        return 'lines' not in block or block['lines'] > 0
+    if start_text and block['end'] < start_text or end_text and block['start'] > end_text:
+        return False
+    if bbox:
+        south, west, north, east = bbox
+        return not (block['north'] < south or block['south'] > north or
+                    block['east'] < west or block['west'] > east)
+    return True
+
+def corpus_blocks(blocked_path):
+    """Return the block index of a file written by compress_corpus: a list of
+    dictionaries with the offset, length, and line count of each block."""
+    with open(blocked_path + '.idx', encoding='utf8') as index:
+        return json.load(index)
+
+def read_corpus_block(blocked_path, block):
+    """Return the lines of one block of a file written by compress_corpus.
+
+    block -- an entry of corpus_blocks(blocked_path)
+    """
+    with open(blocked_path, 'rb') as source:
+        source.seek(block['offset'])
+        data = gzip.decompress(source.read(block['length']))
+    return io.StringIO(data.decode('utf8'), newline=None).readlines()
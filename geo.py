@@ -4,6 +4,11 @@ from data import DATA_PATH
 from math import sin, cos, atan2, radians, sqrt
 from json import JSONDecoder
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 def make_position(lat, lon):
     """Return a geographic position, which has a latitude and longitude."""
     return (lat, lon)
@@ -16,6 +21,9 @@ def longitude(position):
     """Return the longitudinal coordinate of a geographic position."""
     return position[1]
 
+EARTH_RADIUS = 3963.2  # miles
+NEAREST_CHUNK_SIZE = 4096  # positions per distance matrix in nearest
+
 def geo_distance(position1, position2):
     """Return the great circle distance (in miles) between two
     geographic positions.
@@ -26,7 +34,7 @@ def geo_distance(position1, position2):
     >>> round(geo_distance(make_position(50, 5), make_position(58, 3)), 1)
     559.2
     """
-    earth_radius = 3963.2  # miles
+    earth_radius = EARTH_RADIUS
     lat1, lat2 = [radians(latitude(p)) for p in (position1, position2)]
     lon1, lon2 = [radians(longitude(p)) for p in (position1, position2)]
     dlat, dlon = lat2-lat1, lon2-lon1
@@ -34,6 +42,129 @@ def geo_distance(position1, position2):
     c = 2 * atan2(sqrt(a), sqrt(1-a));
     return earth_radius * c;
 
+if numpy is not None:
+    # NumPy's arctan2 and integer powers differ from the C library's in the
+    # last bit for some arguments, so exact distances call math.atan2 once per
+    # element (a Python-level loop, which dominates their cost) and square with
+    # float_power.  NumPy's sin and cos may also use SIMD kernels that differ
+    # from the C library's on some platforms; the doctests check agreement.
+    _exact_atan2 = numpy.vectorize(atan2, otypes=[float])
+    _exact_square = lambda x: numpy.float_power(x, 2)
+
+def _haversine(lat1, lon1, lat2, lon2, exact=True):
+    """Return great circle distances between arrays of latitudes and
+    longitudes in degrees, broadcast together.  If exact, they are computed
+    with the same operations as geo_distance; otherwise with NumPy's faster
+    functions, which may differ from geo_distance in the last bit."""
+    atan2s, square = (_exact_atan2, _exact_square) if exact else (numpy.arctan2, numpy.square)
+    lat1, lon1, lat2, lon2 = (numpy.radians(v) for v in (lat1, lon1, lat2, lon2))
+    dlat, dlon = lat2-lat1, lon2-lon1
+    a = square(numpy.sin(dlat/2)) + square(numpy.sin(dlon/2)) * numpy.cos(lat1) * numpy.cos(lat2)
+    c = 2 * atan2s(numpy.sqrt(a), numpy.sqrt(1-a))
+    return EARTH_RADIUS * c
+
+def _is_position(value):
+    return not isinstance(value[0], (list, tuple))
+
+def _lats_lons(positions):
+    points = numpy.asarray(positions, dtype=float)
+    return points[..., 0], points[..., 1]
+
+def geo_distance_many(positions1, positions2):
+    """Return the great circle distances (in miles) between corresponding
+    positions in two sequences, either of which may be a single position.
+
+    The distances are equal to those of geo_distance.  They are a NumPy array
+    when NumPy is available, and a list otherwise.
+
+    >>> [round(float(d), 1) for d in geo_distance_many(make_position(50, 5), [make_position(58, 3), make_position(50, 5)])]
+    [559.2, 0.0]
+    >>> points = [make_position(lat / 7, lon / 3) for lat in range(-600, 600, 37) for lon in range(-540, 540, 41)]
+    >>> list(geo_distance_many(make_position(38, -122), points)) == [geo_distance(make_position(38, -122), p) for p in points]
+    True
+    """
+    if numpy is None:
+        if _is_position(positions1):
+            positions1 = [positions1] * (1 if _is_position(positions2) else len(positions2))
+        if _is_position(positions2):
+            positions2 = [positions2] * len(positions1)
+        return [geo_distance(p1, p2) for p1, p2 in zip(positions1, positions2)]
+    return _haversine(*(_lats_lons(positions1) + _lats_lons(positions2)))
+
+def distance_matrix(points_a, points_b, exact=True):
+    """Return the matrix of great circle distances (in miles) from each of
+    points_a (rows) to each of points_b (columns), equal to those of
+    geo_distance.  It is a NumPy array when NumPy is available, and a list
+    of lists otherwise.  If exact is false, NumPy computes them faster, but
+    they may differ from those of geo_distance in the last bit.
+
+    >>> m = distance_matrix([make_position(50, 5)], [make_position(58, 3), make_position(50, 5)])
+    >>> [[round(float(d), 1) for d in row] for row in m]
+    [[559.2, 0.0]]
+    """
+    if numpy is None:
+        return [[geo_distance(a, b) for b in points_b] for a in points_a]
+    lats_a, lons_a = _lats_lons(points_a)
+    lats_b, lons_b = _lats_lons(points_b)
+    return _haversine(lats_a[:, None], lons_a[:, None], lats_b[None, :], lons_b[None, :], exact)
+
+def nearest(positions, candidates):
+    """Return the index in candidates of the closest candidate position to
+    each position, preferring the first of equally close candidates.
+
+    Distances are computed with NumPy's fast functions, and candidates within
+    a rounding error of the closest are compared again with geo_distance, so
+    the choices are those of geo_distance on every platform.
+
+    >>> nearest([make_position(38, -122), make_position(41, -74)], [make_position(40.7, -74), make_position(37.8, -122.4)])
+    [1, 0]
+    """
+    if numpy is None:
+        indices = range(len(candidates))
+        return [min(indices, key=lambda i: geo_distance(p, candidates[i])) for p in positions]
+    closest = []
+    for start in range(0, len(positions), NEAREST_CHUNK_SIZE):
+        chunk = positions[start:start + NEAREST_CHUNK_SIZE]
+        matrix = distance_matrix(chunk, candidates, exact=False)
+        near = matrix <= matrix.min(axis=1, keepdims=True) * (1 + 1e-12) + 1e-9
+        indices = matrix.argmin(axis=1)
+        for row in numpy.flatnonzero(near.sum(axis=1) > 1):  # Near-ties
+            position = chunk[row]
+            indices[row] = min(numpy.flatnonzero(near[row]),
+                               key=lambda i: (geo_distance(position, candidates[i]), i))
+        closest.extend(int(i) for i in indices)
+    return closest
+
+def point_in_polygon(position, polygon):
+    """Return whether a geographic position lies inside a polygon, which is a
+    list of positions.  Uses the even-odd rule.
+
+    >>> square = [make_position(0, 0), make_position(0, 2), make_position(2, 2), make_position(2, 0)]
+    >>> point_in_polygon(make_position(1, 1), square), point_in_polygon(make_position(3, 1), square)
+    (True, False)
+    """
+    lat, lon = latitude(position), longitude(position)
+    inside = False
+    previous = polygon[-1]
+    for vertex in polygon:
+        lat1, lon1 = latitude(previous), longitude(previous)
+        lat2, lon2 = latitude(vertex), longitude(vertex)
+        if (lat1 > lat) != (lat2 > lat):
+            if lon < lon1 + (lat - lat1) * (lon2 - lon1) / (lat2 - lat1):
+                inside = not inside
+        previous = vertex
+    return inside
+
+def shift_longitude(lon):
+    """Return lon, shifted by -360 degrees if it is east of the prime
+    meridian, so that a region crossing the antimeridian, such as Alaska with
+    the western Aleutians, has contiguous longitudes.
+
+    >>> shift_longitude(179), shift_longitude(-170)
+    (-181, -170)
+    """
+    return lon - 360 if lon > 0 else lon
+
 def position_to_xy(position):
     """Convert a geographic position within the US to a planar x-y point."""
     lat = latitude(position)
@@ -45,6 +176,34 @@ def position_to_xy(position):
     else:
         return _lower48(position)
 
+def project_many(lats, lons):
+    """Convert many geographic positions within the US to planar x-y points.
+
+    Returns a pair (xs, ys) of coordinate sequences that match position_to_xy
+    applied to each (lat, lon) pair.  When NumPy is available, all three
+    projections are computed as array operations over a region mask and the
+    results are NumPy arrays; otherwise they are lists.
+
+    >>> xs, ys = project_many([38, 60, 20], [-98, -160, -160])
+    >>> [(round(float(x), 5), round(float(y), 5)) for x, y in zip(xs, ys)]
+    [(480.0, 250.0), (150.0, 440.0), (300.0, 450.0)]
+    """
+    if numpy is None:
+        points = [position_to_xy(make_position(lat, lon))
+                  for lat, lon in zip(lats, lons)]
+        return [x for x, _ in points], [y for _, y in points]
+    lats = numpy.asarray(lats, dtype=float)
+    lons = numpy.asarray(lons, dtype=float)
+    xs, ys = numpy.empty_like(lats), numpy.empty_like(lats)
+    hawaii = lats < 25
+    alaska = lats > 52
+    lower48 = ~(hawaii | alaska)
+    for mask, project in ((hawaii, _hawaii), (alaska, _alaska),
+                          (lower48, _lower48)):
+        if mask.any():
+            xs[mask], ys[mask] = project.many(lats[mask], lons[mask])
+    return xs, ys
+
 def albers_projection(origin, parallels, translate, scale):
     """Return an Albers projection from geographic positions to x-y positions.
 
@@ -72,20 +231,33 @@ def albers_projection(origin, parallels, translate, scale):
         x = scale * p * sin(t) + translate[0]
         y = scale * (p * cos(t) - p0) + translate[1]
         return (x, y)
+
+    def project_many(lats, lons):
+        """Project NumPy arrays of latitudes and longitudes at once."""
+        lats, lons = numpy.radians(lats), numpy.radians(lons)
+        t = n * (lons - base_lon)
+        p = numpy.sqrt(C - 2*n*numpy.sin(lats))/n
+        xs = scale * p * numpy.sin(t) + translate[0]
+        ys = scale * (p * numpy.cos(t) - p0) + translate[1]
+        return xs, ys
+    project.many = project_many
     return project
 
 _lower48 = albers_projection(make_position(38, -98), [29.5, 45.5], [480,250], 1000)
 _alaska = albers_projection(make_position(60, -160), [55,65], [150,440], 400)
 _hawaii = albers_projection(make_position(20, -160), [8,18], [300,450], 1000)
 
-def load_states():
+def load_states(file_name=DATA_PATH + 'states.json'):
     """Load the coordinates of all the state outlines and return them
     in a dictionary, from names to shapes lists.
 
+    file_name -- a file of the same format as states.json, which may hold
+                 other regions than states
+
     >>> len(load_states()['HI'])  # Hawaii has 5 islands
     5
     """
-    json_data_file = open(DATA_PATH + 'states.json', encoding='utf8')
+    json_data_file = open(file_name, encoding='utf8')
     states = JSONDecoder().decode(json_data_file.read())
     for state, shapes in states.items():
         for index, shape in enumerate(shapes):
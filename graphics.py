@@ -2,6 +2,7 @@
 
 import sys
 import math
+from itertools import chain
 
 try:
     import tkinter
@@ -54,19 +55,20 @@ class Canvas(object):
             self._draw_background()
         self._canvas.update()
 
-    def draw_polygon(self, points, color='Black', fill_color=None, filled=1, smooth=0, width=1):
+    def draw_polygon(self, points, color='Black', fill_color=None, filled=1, smooth=0, width=1, tag=None):
         """Draw a polygon and return its tkinter id.
 
         points -- a list of (x, y) pairs encoding pixel positions
+        tag -- an optional name that clear(tag) uses to remove the shape
         """
         if fill_color == None:
             fill_color = color
         if filled == 0:
             fill_color = ""
         return self._canvas.create_polygon(flattened(points), outline=color, fill=fill_color,
-                smooth=smooth, width=width)
+                smooth=smooth, width=width, tags=tag or ())
 
-    def draw_circle(self, center, radius, color='Black', fill_color=None, filled=1, width=1):
+    def draw_circle(self, center, radius, color='Black', fill_color=None, filled=1, width=1, tag=None):
         """Draw a cirlce and return its tkinter id.
 
         center -- an (x, y) pair encoding a pixel position
@@ -77,9 +79,40 @@ class Canvas(object):
             fill_color = ""
         x0, y0 = [c - radius for c in center]
         x1, y1 = [c + radius for c in center]
-        return self._canvas.create_oval(x0, y0, x1, y1, outline=color, fill=fill_color, width=width)
+        return self._canvas.create_oval(x0, y0, x1, y1, outline=color, fill=fill_color, width=width,
+                tags=tag or ())
 
-    def draw_image(self, pos, image_file=None, scale=1, anchor=tkinter.NW):
+    def draw_polygons(self, polygons, width=1, tag=None):
+        """Draw many polygons at once and return a list of their tkinter ids.
+
+        The whole batch is sent to Tk as a single Tcl script, and the window
+        is updated once at the end instead of after each shape.
+
+        polygons -- a sequence of (points, color, fill_color) triples
+        """
+        commands = []
+        for points, color, fill_color in polygons:
+            if fill_color == None:
+                fill_color = color
+            commands.append('[{0} create polygon {1} -outline {{{2}}} -fill {{{3}}} -width {4} -tags {{{5}}}]'.format(
+                self._canvas, _tcl_coords(points), color, fill_color, width, tag or ''))
+        return self._draw_batch(commands)
+
+    def draw_circles(self, circles, width=1, tag=None):
+        """Draw many circles at once and return a list of their tkinter ids.
+
+        circles -- a sequence of (center, radius, color, fill_color) tuples
+        """
+        commands = []
+        for (x, y), radius, color, fill_color in circles:
+            if fill_color == None:
+                fill_color = color
+            corners = [(x - radius, y - radius), (x + radius, y + radius)]
+            commands.append('[{0} create oval {1} -outline {{{2}}} -fill {{{3}}} -width {4} -tags {{{5}}}]'.format(
+                self._canvas, _tcl_coords(corners), color, fill_color, width, tag or ''))
+        return self._draw_batch(commands)
+
+    def draw_image(self, pos, image_file=None, scale=1, anchor='nw'):
         """Draw an image from a file and return its tkinter id."""
         key = (image_file, scale)
         if key not in self._images:
@@ -95,7 +128,7 @@ class Canvas(object):
         return self._canvas.create_image(x, y, image=image, anchor=anchor)
 
     def draw_text(self, text, pos, color='Black', font='Arial',
-                  size=12, style='normal', anchor=tkinter.NW):
+                  size=12, style='normal', anchor='nw'):
         """Draw text and return its tkinter id."""
         x, y = pos
         font = (font, str(size), style)
@@ -111,6 +144,24 @@ class Canvas(object):
         if font is not None:
             self._canvas.itemconfigure(id, font=(font, str(size), style))
 
+    def edit_shape(self, id, color=None, fill_color=None):
+        """Edit the outline or fill color of an existing polygon or circle."""
+        if color is not None:
+            self._canvas.itemconfigure(id, outline=color)
+        if fill_color is not None:
+            self._canvas.itemconfigure(id, fill=fill_color)
+
+    def edit_shapes(self, edits):
+        """Change the fill colors of many shapes with a single Tcl call.
+
+        edits -- a sequence of (id, fill_color) pairs
+        """
+        commands = ['{0} itemconfigure {1} -fill {{{2}}}'.format(self._canvas, id, fill_color)
+                    for id, fill_color in edits]
+        if commands:
+            self._tk.tk.eval('\n'.join(commands))
+            self._canvas.update_idletasks()
+
     def animate_shape(self, id, duration, points_fn, frame_count=0):
         """Animate an existing shape over points."""
         max_frames = duration // FRAME_TIME
@@ -122,6 +173,17 @@ class Canvas(object):
                 self.animate_shape(id, duration, points_fn, frame_count + 1)
             self._tk.after(int(FRAME_TIME * 1000), tail)
 
+    def animate(self, frame_fn, frame_count, frame=0):
+        """Call frame_fn with each frame number in turn, one frame per FRAME_TIME."""
+        if frame >= frame_count:
+            return
+        frame_fn(frame)
+        if frame + 1 < frame_count:
+            def tail():
+                """Continues the animation at the next frame."""
+                self.animate(frame_fn, frame_count, frame + 1)
+            self._tk.after(int(FRAME_TIME * 1000), tail)
+
     def slide_shape(self, id, end_pos, duration, elapsed=0):
         """Slide an existing shape to end_pos."""
         points = paired(self._canvas.coords(id))
@@ -158,6 +220,13 @@ class Canvas(object):
         corners = [(0,0), (0, h), (w, h), (w, 0)]
         self.draw_polygon(corners, self.color, fill_color=self.color, filled=True, smooth=False)
 
+    def _draw_batch(self, commands):
+        if not commands:
+            return []
+        ids = self._tk.tk.eval('list ' + ' '.join(commands))
+        self._canvas.update_idletasks()
+        return [int(id) for id in self._tk.tk.splitlist(ids)]
+
     def _click(self, event):
         self._click_pos = (event.x, event.y)
 
@@ -168,9 +237,11 @@ class Canvas(object):
 
 def flattened(points):
     """Return a flat list of coordinates from a list of pairs."""
-    coords = list()
-    [coords.extend(p) for p in points]
-    return tuple(coords)
+    return tuple(chain.from_iterable(points))
+
+def _tcl_coords(points):
+    """Format a list of pairs as a Tcl list of coordinates."""
+    return ' '.join('{0:.2f}'.format(c) for c in flattened(points))
 
 def paired(coords):
     """Return a list of pairs from a flat list of coordinates."""
@@ -0,0 +1,44 @@
+"""The headless module holds what the windowless canvases have in common.
+
+RasterCanvas (raster.py) and SvgCanvas (svg.py) stand in for graphics.Canvas
+when there is no window.  HeadlessCanvas gives them the same id numbering,
+batched drawing, and window behavior, so each one only implements drawing
+and saving its own format.
+"""
+
+class HeadlessCanvas(object):
+    """The parts of a Canvas that do not depend on how shapes are stored.
+
+    Subclasses implement draw_polygon, draw_circle, and the other primitives
+    of graphics.Canvas that the map drawing functions use.
+    """
+
+    def __init__(self, width=1024, height=768, title='', color='White'):
+        self.color = color
+        self.width = width
+        self.height = height
+        self.title = title
+        self._next_id = 1
+
+    def draw_polygons(self, polygons, width=1, tag=None):
+        """Draw many (points, color, fill_color) polygons; return their ids."""
+        return [self.draw_polygon(points, color, fill_color, width=width, tag=tag)
+                for points, color, fill_color in polygons]
+
+    def draw_circles(self, circles, width=1, tag=None):
+        """Draw many (center, radius, color, fill_color) circles; return their ids."""
+        return [self.draw_circle(center, radius, color, fill_color, width=width, tag=tag)
+                for center, radius, color, fill_color in circles]
+
+    def animate(self, frame_fn, frame_count, frame=0):
+        """There is no window to show frames in, so draw them all at once."""
+        for frame in range(frame, frame_count):
+            frame_fn(frame)
+
+    def wait_for_click(self, seconds=0):
+        """There is no window to click, so return immediately."""
+        return None, 0
+
+    def _new_id(self):
+        self._next_id += 1
+        return self._next_id - 1
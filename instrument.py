@@ -0,0 +1,101 @@
+"""Lightweight instrumentation: stage timers, counters, and sampled tracing.
+
+Instrumentation is off unless enable is called, as trends.py does for its
+--profile flag.  While it is off, stage and count do almost nothing, and
+no function is wrapped for tracing, so instrumented code runs at full speed.
+
+  with stage('load tweets'):
+      tweets = load_tweets(...)
+  count('tweets parsed', len(tweets))
+
+Unlike ucb.trace, which prints every call, traced functions only log one in
+every sample_every calls, with abbreviated arguments.  A summary table (or a
+JSON file) of stage times and counts is written when the program exits.
+"""
+
+import atexit
+import functools
+import json
+import sys
+import time
+from contextlib import contextmanager
+
+enabled = False
+_stages = {}    # stage name -> [calls, total seconds]
+_counters = {}  # counter name -> count
+_calls = {}     # traced function name -> calls
+
+def enable(output='-', trace=(), sample_every=1000):
+    """Start recording, and report the results at exit to output, which is a
+    JSON file path or '-' for a table on standard error.
+
+    trace -- a sequence of (module, function name) pairs; one in every
+             sample_every calls to each function is logged
+    """
+    global enabled
+    enabled = True
+    for module, name in trace:
+        setattr(module, name, sampled(getattr(module, name), sample_every))
+    atexit.register(report, output)
+
+@contextmanager
+def stage(name):
+    """Time the enclosed block as one call of the named stage."""
+    if not enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        totals = _stages.setdefault(name, [0, 0.0])
+        totals[0] += 1
+        totals[1] += time.perf_counter() - start
+
+def count(name, n=1):
+    """Add n to the named counter."""
+    if enabled:
+        _counters[name] = _counters.get(name, 0) + n
+
+def sampled(fn, sample_every):
+    """Wrap fn to log its arguments and result once every sample_every calls."""
+    name = fn.__name__
+    _calls.setdefault(name, 0)
+
+    @functools.wraps(fn)
+    def wrapped(*args, **kwds):
+        _calls[name] += 1
+        if _calls[name] % sample_every:
+            return fn(*args, **kwds)
+        result = fn(*args, **kwds)
+        reprs = [_abbreviate(a) for a in args]
+        reprs += [k + '=' + _abbreviate(v) for k, v in kwds.items()]
+        print('[call {0}] {1}({2}) -> {3}'.format(_calls[name], name, ', '.join(reprs),
+              _abbreviate(result)), file=sys.stderr)
+        return result
+    return wrapped
+
+def _abbreviate(value, width=60):
+    text = repr(value)
+    return text if len(text) <= width else text[:width - 3] + '...'
+
+def summary():
+    """Return a JSON-serializable dictionary of everything recorded."""
+    return {'stages': {name: {'calls': calls, 'seconds': seconds}
+                       for name, (calls, seconds) in _stages.items()},
+            'counters': dict(_counters),
+            'traced_calls': dict(_calls)}
+
+def report(output='-'):
+    """Write the summary to a JSON file, or as a table if output is '-'."""
+    results = summary()
+    if output != '-':
+        with open(output, mode='w', encoding='utf8') as out:
+            json.dump(results, out, indent=2)
+        return
+    lines = ['{0:>28}  {1:>6}  {2:>10}'.format('stage', 'calls', 'ms')]
+    for name, totals in results['stages'].items():
+        lines.append('{0:>28}  {1:>6}  {2:>10.2f}'.format(name, totals['calls'], totals['seconds'] * 1000))
+    for name, n in sorted(results['counters'].items()) + sorted(results['traced_calls'].items()):
+        lines.append('{0:>28}  {1:>6}'.format(name, n))
+    print('\n'.join(lines), file=sys.stderr)
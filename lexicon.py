@@ -0,0 +1,163 @@
+"""A compact, read-only sentiment lexicon that processes can share.
+
+data.word_sentiments is an ordinary dictionary, so every worker process
+holds its own copy of about 22,000 words and scores.  A CompactLexicon
+holds the same entries in one file instead, which is memory-mapped, so
+forked workers (and separate processes) share one physical copy:
+
+  scores         one float64 per word, in the order of the sorted words
+  offsets        one uint32 per word, plus one, into the keys blob
+  displacements  one uint32 per hash bucket
+  slots          one uint32 per hash slot: a word's index plus one, or 0
+  keys           the sorted words, encoded as UTF-8, in one blob
+
+Words are found by a perfect hash (hash and displace): a word's bucket
+gives a displacement that moves every word in the bucket to its own slot,
+so a lookup hashes the word, reads one slot, and compares one key.  That
+takes about a microsecond, many times longer than a dictionary lookup, so
+the compact lexicon suits many workers short of memory rather than one
+process short of time.  trends.py uses it with --compact_lexicon, and then
+never loads data.word_sentiments.  Scoring by phrases (see phrases.py)
+builds an automaton of the lexicon in each process, so it saves memory only
+for scoring by words.
+
+Scores are stored as float64 rather than float32, since some lexicon
+scores are not exactly representable in 32 bits, and lookups must match
+get_word_sentiment exactly.
+
+Lexicon files are built once, cached in the data directory, and rebuilt if
+sentiments.csv changes.
+"""
+
+import zlib
+from array import array
+from collections.abc import Mapping
+from math import ceil
+from data import DATA_PATH, load_sentiments, load_mapped_file
+
+WORDS_PER_BUCKET = 4
+SLOTS_PER_WORD = 1.25
+MAX_DISPLACEMENT = 1 << 16
+
+def _second_hash(first):
+    """Return the step between a word's slots for successive displacements."""
+    return (first >> 16 ^ first * 0x9e3779b1) & 0xffffffff | 1
+
+def _prime_at_least(n):
+    """Return the smallest prime of at least n, so that every odd step
+    between slots visits all of them."""
+    n = max(n, 3)
+    while any(n % d == 0 for d in range(2, int(n ** 0.5) + 1)):
+        n += 1
+    return n
+
+class CompactLexicon(Mapping):
+    """A read-only mapping from words to sentiment scores.
+
+    >>> lexicon = load_lexicon()
+    >>> from data import word_sentiments
+    >>> len(lexicon) == len(word_sentiments)
+    True
+    >>> all(lexicon.get(word) == score for word, score in word_sentiments.items())
+    True
+    >>> lexicon.get('good'), lexicon.get('Berkeley'), 'bad' in lexicon
+    (0.875, None, True)
+    """
+
+    def __init__(self, header, buffer):
+        self.buffer = buffer
+        view = memoryview(buffer)[header.get('offset', 0):]
+        count, buckets, size = header['count'], header['buckets'], header['slots']
+        sections = []
+        for length, code, width in ((count, 'd', 8), (count + 1, 'I', 4),
+                                    (buckets, 'I', 4), (size, 'I', 4)):
+            sections.append(view[:length * width].cast(code))
+            view = view[length * width:]
+        self._scores, self._offsets, self._displacements, self._slots = sections
+        self._keys = view
+        self._count, self._buckets, self._size = count, buckets, size
+
+    def __len__(self):
+        return self._count
+
+    def _key(self, index):
+        return self._keys[self._offsets[index]:self._offsets[index + 1]]
+
+    def __iter__(self):
+        for index in range(self._count):
+            yield bytes(self._key(index)).decode('utf8')
+
+    def _index(self, word):
+        """Return the index of word, or -1 if it is not in the lexicon."""
+        key = word.encode('utf8')
+        first = zlib.crc32(key)
+        displacement = self._displacements[first % self._buckets]
+        index = self._slots[(first + displacement * _second_hash(first)) % self._size] - 1
+        if index < 0:
+            return -1
+        offsets = self._offsets
+        start, end = offsets[index], offsets[index + 1]
+        return index if self._keys[start:end] == key else -1
+
+    def __getitem__(self, word):
+        index = self._index(word)
+        if index < 0:
+            raise KeyError(word)
+        return self._scores[index]
+
+    def __contains__(self, word):
+        return self._index(word) >= 0
+
+    def get(self, word, default=None):
+        index = self._index(word)
+        return self._scores[index] if index >= 0 else default
+
+def build_lexicon(sentiments):
+    """Return a (header, contents) pair for a lexicon of sentiments, a
+    dictionary from words to scores."""
+    keys = sorted(word.encode('utf8') for word in sentiments)
+    count = len(keys)
+    buckets = max(1, count // WORDS_PER_BUCKET)
+    size = _prime_at_least(int(ceil(count * SLOTS_PER_WORD)))
+    members = [[] for _ in range(buckets)]
+    for index, key in enumerate(keys):
+        first = zlib.crc32(key)
+        members[first % buckets].append((first, _second_hash(first), index))
+    displacements, slots = array('I', [0]) * buckets, array('I', [0]) * size
+    # Place the largest buckets first, while most slots are still free
+    for bucket in sorted(range(buckets), key=lambda b: -len(members[b])):
+        if not members[bucket]:
+            continue
+        for displacement in range(MAX_DISPLACEMENT):
+            positions = [(first + displacement * second) % size for first, second, _ in members[bucket]]
+            if len(set(positions)) == len(positions) and not any(slots[p] for p in positions):
+                break
+        else:
+            raise ValueError('No perfect hash found for lexicon bucket {0}'.format(bucket))
+        displacements[bucket] = displacement
+        for position, (_, _, index) in zip(positions, members[bucket]):
+            slots[position] = index + 1
+    offsets = array('I', [0])
+    for key in keys:
+        offsets.append(offsets[-1] + len(key))
+    scores = array('d', [sentiments[key.decode('utf8')] for key in keys])
+    header = {'count': count, 'buckets': buckets, 'slots': size}
+    contents = b''.join([scores.tobytes(), offsets.tobytes(), displacements.tobytes(),
+                         slots.tobytes()] + keys)
+    return header, contents
+
+def lexicon_path():
+    """Return the path of the cached lexicon file."""
+    return DATA_PATH + 'sentiments.lex'
+
+_lexicons = []
+
+def load_lexicon():
+    """Return the CompactLexicon of sentiments.csv, memory-mapping a cached
+    lexicon file (see data.load_mapped_file) and building it first if it is
+    missing or out of date."""
+    if not _lexicons:
+        header, buffer = load_mapped_file(lexicon_path(), DATA_PATH + 'sentiments.csv',
+                                          lambda: build_lexicon(load_sentiments()))
+        _lexicons.append(CompactLexicon(header, buffer))
+    return _lexicons[0]
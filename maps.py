@@ -1,7 +1,15 @@
 """Map drawing utilities for U.S. sentiment data."""
 
 from graphics import Canvas
-from geo import position_to_xy, us_states
+from raster import RasterCanvas
+from svg import SvgCanvas
+from geo import position_to_xy, project_many, latitude, longitude, us_states
+from math import sqrt
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 # A fixed gradient of sentiment colors from negative (blue) to positive (red)
 # Colors chosen via Cynthia Brewer's Color Brewer (colorbrewer2.com)
@@ -10,6 +18,14 @@ SENTIMENT_COLORS = ["#313695", "#4575B4", "#74ADD1", "#ABD9E9", "#E0F3F8",
                     "#A50026"]
 GRAY = "#AAAAAA"
 
+# Rendering backends: Canvas classes that share the graphics.Canvas drawing API
+BACKENDS = {'tk': Canvas, 'png': RasterCanvas, 'svg': SvgCanvas}
+_backend = 'tk'
+
+# For each canvas, the shape ids and fill color of each state drawn on it by
+# draw_state_layer
+_state_layers = {}
+
 def get_sentiment_color(sentiment, sentiment_scale=4):
     """Returns a color corresponding to the sentiment value.
 
@@ -32,10 +48,66 @@ def draw_state(shapes, sentiment_value=None):
     sentiment_value -- a number between -1 (negative) and 1 (positive)
     canvas -- the graphics.Canvas object
     """
-    for polygon in shapes:
-        vertices = [position_to_xy(position) for position in polygon]
+    return draw_states([(shapes, sentiment_value)])[0]
+
+def draw_states(states):
+    """Draw many states in one batch and return a list of their shape ids.
+
+    states -- a sequence of (shapes, sentiment_value) pairs, as for draw_state
+    """
+    polygons, counts = [], []
+    for shapes, sentiment_value in states:
+        color = get_sentiment_color(sentiment_value)
+        for polygon in shapes:
+            vertices = [position_to_xy(position) for position in polygon]
+            polygons.append((vertices, 'Black', color))
+        counts.append(len(shapes))
+    ids = iter(get_canvas().draw_polygons(polygons))
+    return [[next(ids) for _ in range(count)] for count in counts]
+
+def draw_state_layer(states):
+    """Color named states, drawing their outlines only the first time.
+
+    States that are already on the canvas are recolored in place, so a new
+    query only changes the fill colors of states whose color changed.  Return
+    the names of the states that were newly drawn.
+
+    states -- a dictionary from state names to (shapes, sentiment_value) pairs
+    """
+    canvas = get_canvas()
+    layer = _state_layers.setdefault(canvas, {})
+    edits, new = [], []
+    for name, (shapes, sentiment_value) in states.items():
         color = get_sentiment_color(sentiment_value)
-        get_canvas().draw_polygon(vertices, fill_color=color)
+        if name not in layer:
+            new.append(name)
+        elif layer[name][1] != color:
+            edits.extend((id, color) for id in layer[name][0])
+            layer[name] = (layer[name][0], color)
+    canvas.edit_shapes(edits)
+    for name, ids in zip(new, draw_states([states[name] for name in new])):
+        layer[name] = (ids, get_sentiment_color(states[name][1]))
+    return new
+
+def animate_state_layer(frames, shapes, labels=None):
+    """Animate a sequence of state colorings, one frame at a time.
+
+    Each frame only recolors the states whose color changed since the previous
+    frame, so the work per frame is bounded by the number of states.
+
+    frames -- a list of dictionaries from state names to sentiment values
+    shapes -- a dictionary from state names to shapes
+    labels -- an optional list of strings to display with each frame
+    """
+    canvas = get_canvas()
+    label = labels and canvas.draw_text(labels[0], (canvas.width - 10, 10),
+                                        size=14, anchor='ne')
+    def draw_frame(frame):
+        draw_state_layer({name: (shapes[name], frames[frame].get(name, None))
+                          for name in shapes})
+        if labels:
+            canvas.edit_text(label, text=labels[frame], size=14)
+    canvas.animate(draw_frame, len(frames))
 
 def draw_name(name, location):
     """Draw the two-letter postal code at the center of the state.
@@ -55,6 +127,137 @@ def draw_dot(location, sentiment_value=None, radius=3):
     color = get_sentiment_color(sentiment_value)
     get_canvas().draw_circle(center, radius, fill_color=color)
 
+def draw_dots(locations, sentiment_values, radius=3):
+    """Draw a small dot at each location, projecting all of them at once.
+
+    locations -- a sequence of positions
+    sentiment_values -- a sequence of numbers, one for each location
+    """
+    lats = [latitude(location) for location in locations]
+    lons = [longitude(location) for location in locations]
+    xs, ys = project_many(lats, lons)
+    circles = [((float(x), float(y)), radius, 'Black', get_sentiment_color(value))
+               for x, y, value in zip(xs, ys, sentiment_values)]
+    get_canvas().draw_circles(circles, tag='dot')
+
+def draw_binned_dots(locations, sentiment_values, size=12, shape='hex'):
+    """Draw one shape per screen-space bin instead of one dot per location.
+
+    Each bin is colored by the mean sentiment of its locations and scaled by
+    the number of locations it holds, so drawing cost is bounded by the number
+    of occupied bins.
+
+    size -- the width of a square bin or the radius of a hexagonal bin, in pixels
+    shape -- 'hex' or 'square'
+    """
+    lats = [latitude(location) for location in locations]
+    lons = [longitude(location) for location in locations]
+    xs, ys = project_many(lats, lons)
+    bins = bin_dots(xs, ys, sentiment_values, size, shape)
+    if not bins:
+        return
+    most = max(count for _, _, count, _ in bins)
+    polygons = []
+    for x, y, count, mean in bins:
+        radius = size / 2 * (0.3 + 0.7 * sqrt(count / most))
+        if shape == 'hex':
+            radius *= 2
+            corners = [(0, -1), (0.866, -0.5), (0.866, 0.5),
+                       (0, 1), (-0.866, 0.5), (-0.866, -0.5)]
+        else:
+            corners = [(-1, -1), (1, -1), (1, 1), (-1, 1)]
+        points = [(x + dx * radius, y + dy * radius) for dx, dy in corners]
+        color = get_sentiment_color(mean)
+        polygons.append((points, color, color))
+    get_canvas().draw_polygons(polygons, tag='dot')
+
+def bin_dots(xs, ys, values, size, shape='hex'):
+    """Aggregate points into screen-space bins.
+
+    Returns a list of (x, y, count, mean) tuples, one for each occupied bin,
+    where (x, y) is the bin center and mean is the mean of the values of the
+    points in the bin.
+
+    >>> bin_dots([1, 2, 15], [1, 3, 1], [0.5, -0.25, 1], 10, 'square')
+    [(5.0, 5.0, 2, 0.125), (15.0, 5.0, 1, 1.0)]
+    """
+    if shape == 'hex':
+        keys, centers = _hex_bins(xs, ys, size)
+    elif shape == 'square':
+        keys, centers = _square_bins(xs, ys, size)
+    else:
+        raise ValueError('Unknown bin shape: {0}'.format(shape))
+    if numpy is not None and len(keys):
+        keys = numpy.asarray(keys)
+        unique, first, inverse = numpy.unique(keys, axis=0, return_index=True,
+                                              return_inverse=True)
+        inverse = inverse.reshape(-1)
+        counts = numpy.bincount(inverse)
+        totals = numpy.bincount(inverse, weights=numpy.asarray(values, dtype=float))
+        return [(float(centers[i][0]), float(centers[i][1]), int(n), float(t / n))
+                for i, n, t in zip(first, counts, totals)]
+    bins = {}
+    for key, center, value in zip(keys, centers, values):
+        key = tuple(key)
+        if key in bins:
+            bins[key][1] += 1
+            bins[key][2] += value
+        else:
+            bins[key] = [center, 1, value]
+    return [(float(center[0]), float(center[1]), count, total / count)
+            for center, count, total in sorted(bins.values())]
+
+def _square_bins(xs, ys, size):
+    """Return bin keys and bin centers for square bins of the given width."""
+    if numpy is not None:
+        keys = numpy.floor(numpy.column_stack([xs, ys]) / size).astype(int)
+        return keys, (keys + 0.5) * size
+    keys = [(int(x // size), int(y // size)) for x, y in zip(xs, ys)]
+    return keys, [((i + 0.5) * size, (j + 0.5) * size) for i, j in keys]
+
+def _hex_bins(xs, ys, size):
+    """Return bin keys and bin centers for pointy-topped hexagonal bins with
+    the given radius, using axial coordinates rounded through cube coordinates.
+    """
+    def round_axial(q, r):
+        s = -q - r
+        rq, rr, rs = round(q), round(r), round(s)
+        dq, dr, ds = abs(rq - q), abs(rr - r), abs(rs - s)
+        if dq > dr and dq > ds:
+            rq = -rr - rs
+        elif dr > ds:
+            rr = -rq - rs
+        return rq, rr
+
+    if numpy is not None:
+        xs, ys = numpy.asarray(xs, dtype=float), numpy.asarray(ys, dtype=float)
+        q = (sqrt(3) / 3 * xs - ys / 3) / size
+        r = (2 / 3 * ys) / size
+        s = -q - r
+        rq, rr, rs = numpy.round(q), numpy.round(r), numpy.round(s)
+        dq, dr, ds = abs(rq - q), abs(rr - r), abs(rs - s)
+        fix_q = (dq > dr) & (dq > ds)
+        fix_r = ~fix_q & (dr > ds)
+        rq = numpy.where(fix_q, -rr - rs, rq)
+        rr = numpy.where(fix_r, -rq - rs, rr)
+        keys = numpy.column_stack([rq, rr]).astype(int)
+    else:
+        keys = [round_axial((sqrt(3) / 3 * x - y / 3) / size, (2 / 3 * y) / size)
+                for x, y in zip(xs, ys)]
+    centers = [(size * sqrt(3) * (q + r / 2), size * 3 / 2 * r) for q, r in keys]
+    return keys, centers
+
+def clear_dots():
+    """Remove the dots and bins drawn by draw_dots and draw_binned_dots."""
+    get_canvas().clear('dot')
+
+def clear_map():
+    """Remove everything from the canvas, so that the next states drawn by
+    draw_state_layer are drawn in full rather than recolored."""
+    canvas = get_canvas()
+    canvas.clear()
+    _state_layers.pop(canvas, None)
+
 def memoize(fn):
     """A decorator for caching the results of the decorated function."""
     cache = {}
@@ -66,10 +269,28 @@ def memoize(fn):
         return result
     return memoized
 
-@memoize
+def set_backend(name):
+    """Select the rendering backend used by get_canvas.
+
+    name -- a key of BACKENDS, such as 'tk' for a window, 'png' for a
+    headless raster image, or 'svg' for a vector image
+    """
+    global _backend
+    if name not in BACKENDS:
+        raise ValueError('Unknown backend: {0}'.format(name))
+    _backend = name
+
 def get_canvas():
-    """Return a Canvas, which is a drawing window."""
-    return Canvas(width=960, height=500)
+    """Return a Canvas, which is a drawing window or an off-screen image."""
+    return _make_canvas(_backend)
+
+@memoize
+def _make_canvas(backend):
+    return BACKENDS[backend](width=960, height=500)
+
+def save(path):
+    """Save the map drawn so far to path (requires a headless backend)."""
+    get_canvas().save(path)
 
 def wait(secs=0):
     """Wait for mouse click."""
@@ -0,0 +1,150 @@
+"""Phrase and negation aware sentiment scoring.
+
+analyze_tweet_sentiment averages the scores of single words, so multi-word
+lexicon entries such as "no matter" never match, and "not good" scores as
+positive.  A PhraseAutomaton compiles every entry of the lexicon, single
+words and phrases alike, into one Aho-Corasick automaton over words.  A
+text is then scored in one pass over its tokens:
+
+1. The automaton reports the longest entry ending at each token.  An entry
+   that covers earlier matches replaces them, so each word is scored as part
+   of at most one entry, preferring the longest.
+
+2. A negation word, such as "not" or the "t" of "don't", that is not part
+   of a matched entry negates the matches that start within the next
+   NEGATION_SCOPE words, scaling their scores by NEGATED_SCALE.  Clause
+   punctuation ends the scope.  Negation words are not scored on their own.
+
+The score of a text is the average score of its matches, as in
+analyze_tweet_sentiment.  Entries whose words are split by hyphens or
+apostrophes match the same words split by any non-letters; entries with
+digits or other characters are left out, since words never contain them.
+"""
+
+import re
+
+NEGATIONS = frozenset(['not', 'no', 'never', 'nothing', 'nobody', 'none', 'neither', 'nor',
+                       'without', 'cannot', 't', 'dont', 'cant', 'wont', 'isnt', 'arent',
+                       'wasnt', 'werent', 'didnt', 'doesnt', 'couldnt', 'shouldnt',
+                       'wouldnt', 'aint'])
+NEGATION_SCOPE = 3  # words
+NEGATED_SCALE = -0.5
+CLAUSE_BREAK = None  # The token for clause punctuation
+
+_token = re.compile(r"[a-zA-Z]+|[.,!?;:]")
+_entry = re.compile(r"[a-z]+(?:[ '-][a-z]+)*")
+
+def tokenize(text):
+    """Return the words of text, as extract_words does, with CLAUSE_BREAK
+    in place of clause punctuation.
+
+    >>> tokenize("don't go, it's not good!")
+    ['don', 't', 'go', None, 'it', 's', 'not', 'good', None]
+    """
+    return [t if t[0].isalpha() else CLAUSE_BREAK for t in _token.findall(text)]
+
+class PhraseAutomaton(object):
+    """An Aho-Corasick automaton over the words of lexicon entries.
+
+    >>> automaton = PhraseAutomaton({'good': 0.875, 'not bad': 0.75, 'bad': -0.625,
+    ...                              'no matter': -0.25, 'not': -0.625, 'matter': 0.25})
+    >>> automaton.score('good')
+    0.875
+    >>> automaton.score('not good')
+    -0.4375
+    >>> automaton.score('not bad')
+    0.75
+    >>> automaton.score('no matter, good')
+    0.3125
+    >>> automaton.score('not. good'), automaton.score('not')
+    (0.875, None)
+    """
+
+    def __init__(self, sentiments):
+        """Compile the entries of sentiments, a mapping from entries (words
+        or phrases) to scores."""
+        self._goto = {}       # (state, word) -> state
+        self._depth = [0]     # state -> number of words on the path to it
+        self._scores = [None]  # state -> score of the entry ending there
+        for entry in sorted(sentiments):
+            if not _entry.fullmatch(entry):
+                continue
+            words = tuple(re.split("[ '-]", entry))
+            if words[0] in NEGATIONS and len(words) == 1:
+                continue
+            state = 0
+            for word in words:
+                if (state, word) not in self._goto:
+                    self._goto[state, word] = len(self._depth)
+                    self._depth.append(self._depth[state] + 1)
+                    self._scores.append(None)
+                state = self._goto[state, word]
+            if self._scores[state] is None:  # 'air-tight' and 'air tight' are one entry
+                self._scores[state] = sentiments[entry]
+        self._build_links()
+
+    def _build_links(self):
+        """Compute failure links breadth first, and for each state the state
+        of the longest entry that is a suffix of its path."""
+        children = {}
+        for (state, word), child in self._goto.items():
+            children.setdefault(state, []).append((word, child))
+        self._fail = [0] * len(self._depth)
+        self._match = [state if score is not None else 0 for state, score in enumerate(self._scores)]
+        queue = [child for _, child in children.get(0, ())]
+        for state in queue:
+            for word, child in children.get(state, ()):
+                fallback = self._fail[state]
+                while fallback and (fallback, word) not in self._goto:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto.get((fallback, word), 0)
+                if not self._match[child]:
+                    self._match[child] = self._match[self._fail[child]]
+                queue.append(child)
+
+    def __len__(self):
+        """Return the number of entries in the automaton."""
+        return sum(score is not None for score in self._scores)
+
+    def matches(self, tokens):
+        """Return (start, end, score) for the entries matched in tokens, a
+        list of words and CLAUSE_BREAK, preferring the longest entries."""
+        goto, fail, depth, match, scores = self._goto, self._fail, self._depth, self._match, self._scores
+        found = []
+        state = 0
+        for end, word in enumerate(tokens, 1):
+            if word is CLAUSE_BREAK:
+                state = 0
+                continue
+            while state and (state, word) not in goto:
+                state = fail[state]
+            state = goto.get((state, word), 0)
+            entry = match[state]
+            if entry:
+                start = end - depth[entry]
+                while found and found[-1][0] >= start:
+                    found.pop()  # Covered by this longer entry
+                if not found or found[-1][1] <= start:
+                    found.append((start, end, scores[entry]))
+        return found
+
+    def score(self, text):
+        """Return the average score of the entries matched in text, with
+        negation applied, or None if none match."""
+        tokens = tokenize(text)
+        total, count = 0, 0
+        negated_until = 0  # Matches starting before this token are negated
+        matched_until = 0  # Tokens before this one are part of a match
+        found = iter(self.matches(tokens))
+        next_match = next(found, None)
+        for position, word in enumerate(tokens):
+            if word is CLAUSE_BREAK:
+                negated_until = 0
+            elif next_match and next_match[0] == position:
+                start, matched_until, value = next_match
+                total += value * NEGATED_SCALE if position < negated_until else value
+                count += 1
+                next_match = next(found, None)
+            elif word in NEGATIONS and position >= matched_until:
+                negated_until = position + 1 + NEGATION_SCOPE
+        return total / count if count else None
@@ -0,0 +1,84 @@
+"""Progress reports for long scans of tweets files.
+
+A Progress tracks how much of a file a scan has read and calls a callback
+with a status dictionary at most once per interval seconds, so that frequent
+updates cost little more than a clock read.  print_progress is a callback
+that shows the status on the terminal; the query server keeps the latest
+status of each running query instead.
+"""
+
+import sys
+import time
+
+PROGRESS_INTERVAL = 0.5  # Seconds between reports
+LINES_PER_UPDATE = 1024  # Line-by-line scans update once per this many lines
+
+class Progress(object):
+    """The progress of one scan, reported to callback(status)."""
+
+    def __init__(self, label, callback, total_bytes=None, interval=PROGRESS_INTERVAL):
+        self.label = label
+        self.callback = callback
+        self.bytes = self.lines = self.matches = 0
+        self.position = None  # A function that returns the bytes read so far
+        self.interval = interval
+        self.restart(total_bytes)
+
+    def restart(self, total_bytes=None):
+        """Start timing the scan now, as it begins to read total_bytes."""
+        self.total_bytes = total_bytes
+        self._start = time.monotonic()
+        self._next_report = self._start + self.interval
+
+    def update(self, bytes=None, lines=None, matches=None):
+        """Record the totals so far, reporting them if an interval has passed."""
+        if bytes is not None:
+            self.bytes = bytes
+        if lines is not None:
+            self.lines = lines
+        if matches is not None:
+            self.matches = matches
+        now = time.monotonic()
+        if now >= self._next_report:
+            self._next_report = now + self.interval
+            if self.position:
+                self.bytes = self.position()
+            self.callback(self.status(now))
+
+    def finish(self):
+        """Report the final totals."""
+        if self.total_bytes is not None:
+            self.bytes = self.total_bytes
+        status = self.status(time.monotonic())
+        status['done'] = True
+        self.callback(status)
+
+    def status(self, now):
+        """Return a dictionary describing the progress of the scan at time now."""
+        elapsed = max(now - self._start, 1e-9)
+        status = {'label': self.label, 'bytes': self.bytes, 'total_bytes': self.total_bytes,
+                  'lines': self.lines, 'matches': self.matches, 'elapsed': elapsed,
+                  'lines_per_second': self.lines / elapsed, 'eta': None, 'done': False}
+        if self.total_bytes and self.bytes:
+            status['eta'] = elapsed * (self.total_bytes - self.bytes) / self.bytes
+        return status
+
+def print_progress(status):
+    """Show a progress status on one line of standard error."""
+    megabytes = status['bytes'] / 1e6
+    if status['total_bytes']:
+        read = '{0:.1f} of {1:.1f} MB'.format(megabytes, status['total_bytes'] / 1e6)
+    else:
+        read = '{0:.1f} MB'.format(megabytes)
+    line = '{0}: {1}, {2:.0f} lines/s, {3} matches'.format(
+        status['label'], read, status['lines_per_second'], status['matches'])
+    if status['done']:
+        line += ', done in {0:.1f}s'.format(status['elapsed'])
+    elif status['eta'] is not None:
+        line += ', {0:.0f}s left'.format(status['eta'])
+    end = '\n' if status['done'] else ''
+    print('\r' + line.ljust(78), end=end, file=sys.stderr, flush=True)
+
+def terminal_progress():
+    """Return print_progress if standard error is a terminal, or None."""
+    return print_progress if sys.stderr.isatty() else None
@@ -0,0 +1,256 @@
+"""A small query language for selecting tweets from a tweets file.
+
+A query combines atoms with AND, OR, NOT, and parentheses.  Adjacent atoms
+are joined by AND, and operators must be written in capital letters.
+
+  texas                 tweets containing the word "texas"
+  "my job"              tweets containing the phrase "my job"
+  #winning              tweets with the hashtag #winning
+  @cnn                  tweets that mention @cnn
+  bbox:25,-107,37,-93   tweets within a latitude/longitude bounding box
+                        (south, west, north, east)
+
+For example: (love OR hate) "my job" NOT #monday bbox:25,-107,37,-93
+
+Queries are compiled into predicates over the raw fields of each line, with
+the cheapest predicates checked first, and are evaluated during a single pass
+over the tweets file.  When every match must contain some literal text, the
+scan only decodes lines containing that text, and reads an existing filtered
+file for that text instead of the whole corpus if there is one.
+"""
+
+import re
+from datetime import datetime
+from data import (DATA_PATH, TIME_FORMAT, open_corpus, matching_lines,
+                  split_tweet_line, file_name_for_term, is_complete, scan_size)
+from instrument import count
+from progress import Progress, LINES_PER_UPDATE
+
+OPERATORS = ('AND', 'OR', 'NOT')
+TOKEN = re.compile(r'\s*(?:(\()|(\))|"([^"]*)"|([^\s()"]+))')
+# A comma-separated term: commas inside phrases and between bbox bounds do not separate
+TERM = re.compile(r'(?:"[^"]*"|bbox:[^\s,()"]*(?:,[^\s,()"]*){0,3}|[^,])+', flags=re.IGNORECASE)
+
+# The relative costs of checking each kind of atom
+COSTS = {'bbox': 1, 'word': 3, 'phrase': 3, 'hashtag': 2, 'mention': 2}
+
+def is_query(text):
+    """Return whether text uses query syntax rather than being a plain term.
+
+    >>> is_query('my job')
+    False
+    >>> is_query('texas AND (love OR hate)')
+    True
+    """
+    return any(t in OPERATORS or not t.replace(' ', '').isalnum()
+               for t in tokenize(text))
+
+def canonical_term(term):
+    """Return term in the form used to key its results: plain terms match
+    regardless of case, so they are lowercased, but queries keep their
+    capitalized operators.
+
+    >>> canonical_term('Texas'), canonical_term('texas AND (love OR hate)')
+    ('texas', 'texas AND (love OR hate)')
+    """
+    return term if is_query(term) else term.lower()
+
+def split_terms(text):
+    """Return the terms or queries in a comma-separated list.
+
+    >>> split_terms('texas, my job,love bbox:25,-107,37,-93 "oh, well"')
+    ['texas', 'my job', 'love bbox:25,-107,37,-93 "oh, well"']
+    """
+    return [term.strip() for term in TERM.findall(text) if term.strip()]
+
+def tokenize(text):
+    """Return a list of tokens in a query; quoted phrases are single tokens.
+
+    >>> tokenize('(love OR hate) "my job"')
+    ['(', 'love', 'OR', 'hate', ')', '"my job"']
+    """
+    tokens, position = [], 0
+    text = text.strip()
+    while position < len(text):
+        match = TOKEN.match(text, position)
+        if not match:
+            raise ValueError('Cannot parse query at: ' + text[position:])
+        open_paren, close_paren, phrase, word = match.groups()
+        if phrase is not None:
+            tokens.append('"' + phrase + '"')
+        else:
+            tokens.append(open_paren or close_paren or word)
+        position = match.end()
+    return tokens
+
+def parse(text):
+    """Parse a query into a tree of (operator, operands) tuples.
+
+    >>> parse('texas (love OR hate) NOT #monday')
+    ('and', [('word', 'texas'), ('or', [('word', 'love'), ('word', 'hate')]), ('not', ('hashtag', 'monday'))])
+    >>> parse('"my job" bbox:25,-107,37,-93')
+    ('and', [('phrase', 'my job'), ('bbox', (25.0, -107.0, 37.0, -93.0))])
+    >>> parse('texas ""')
+    Traceback (most recent call last):
+        ...
+    ValueError: Empty phrase in query
+    """
+    tokens = tokenize(text)
+    tree = _parse_or(tokens)
+    if tokens:
+        raise ValueError('Unexpected ' + tokens[0] + ' in query')
+    return tree
+
+def _parse_or(tokens):
+    operands = [_parse_and(tokens)]
+    while tokens and tokens[0] == 'OR':
+        tokens.pop(0)
+        operands.append(_parse_and(tokens))
+    return operands[0] if len(operands) == 1 else ('or', operands)
+
+def _parse_and(tokens):
+    operands = [_parse_not(tokens)]
+    while tokens and tokens[0] not in ('OR', ')'):
+        if tokens[0] == 'AND':
+            tokens.pop(0)
+        operands.append(_parse_not(tokens))
+    return operands[0] if len(operands) == 1 else ('and', operands)
+
+def _parse_not(tokens):
+    if tokens and tokens[0] == 'NOT':
+        tokens.pop(0)
+        return ('not', _parse_not(tokens))
+    return _parse_atom(tokens)
+
+def _parse_atom(tokens):
+    if not tokens:
+        raise ValueError('Incomplete query')
+    token = tokens.pop(0)
+    if token == '(':
+        tree = _parse_or(tokens)
+        if not tokens or tokens.pop(0) != ')':
+            raise ValueError('Missing ) in query')
+        return tree
+    if token in OPERATORS or token == ')':
+        raise ValueError('Unexpected ' + token + ' in query')
+    if token.startswith('"'):
+        if not token[1:-1].strip():
+            raise ValueError('Empty phrase in query')
+        return ('phrase', token[1:-1].lower())
+    if token.startswith('#'):
+        if len(token) == 1:
+            raise ValueError('Empty hashtag in query')
+        return ('hashtag', token[1:].lower())
+    if token.startswith('@'):
+        if len(token) == 1:
+            raise ValueError('Empty mention in query')
+        return ('mention', token[1:].lower())
+    if token.lower().startswith('bbox:'):
+        bounds = tuple(float(v) for v in token[5:].split(','))
+        if len(bounds) != 4:
+            raise ValueError('A bbox needs south,west,north,east bounds')
+        return ('bbox', bounds)
+    return ('word', token.lower())
+
+def compile_query(tree):
+    """Return a (cost, predicate) pair for a parsed query.
+
+    The predicate takes the fields (lat, lon, time text, lowercase text) of a
+    tweet.  Operands of AND and OR are checked cheapest first, and stop as
+    soon as the result is known.
+    """
+    kind, value = tree
+    if kind in ('and', 'or'):
+        compiled = sorted((compile_query(operand) for operand in value),
+                          key=lambda pair: pair[0])
+        predicates = [predicate for _, predicate in compiled]
+        cost = sum(c for c, _ in compiled)
+        if kind == 'and':
+            return cost, lambda fields: all(p(fields) for p in predicates)
+        return cost, lambda fields: any(p(fields) for p in predicates)
+    if kind == 'not':
+        cost, predicate = compile_query(value)
+        return cost, lambda fields: not predicate(fields)
+    if kind == 'bbox':
+        south, west, north, east = value
+        return COSTS[kind], lambda f: south <= f[0] <= north and west <= f[1] <= east
+    literal = _literal(tree)
+    if kind in ('word', 'phrase'):
+        pattern = re.compile(r'(?:^|\W)' + re.escape(literal) + r'(?:\W|$)')
+    else:
+        pattern = re.compile(re.escape(literal) + r'(?!\w)')
+    return COSTS[kind], lambda f: literal in f[3] and pattern.search(f[3]) is not None
+
+def _literal(tree):
+    kind, value = tree
+    return {'hashtag': '#', 'mention': '@'}.get(kind, '') + value
+
+def required_literals(tree):
+    """Return the set of literal strings that every matching tweet contains.
+
+    >>> sorted(required_literals(parse('texas (love OR hate) NOT #monday')))
+    ['texas']
+    """
+    kind, value = tree
+    if kind == 'and':
+        return set().union(*(required_literals(operand) for operand in value))
+    if kind in ('word', 'phrase', 'hashtag', 'mention'):
+        return {_literal(tree)}
+    return set()
+
+def scan_path(query, file_name='tweets2011.txt'):
+    """Return the path of the file that a scan for query reads: an existing
+    filtered file for one of the literals that every match contains, or
+    else file_name itself."""
+    path = DATA_PATH + file_name
+    for literal in sorted(required_literals(parse(query)), key=len, reverse=True):
+        filtered_path = DATA_PATH + file_name_for_term(literal, file_name)
+        if literal.replace(' ', '').isalnum() and is_complete(filtered_path, path):
+            return filtered_path  # An existing filtered file is a ready index
+    return path
+
+def load_matching_tweets(make_tweet, query, file_name='tweets2011.txt', progress=None):
+    """Return the list of tweets in file_name that match query, in one pass.
+
+    make_tweet -- a tweet constructor, as for data.load_tweets
+    progress -- an optional callback for progress reports, as for data.load_tweets
+    """
+    return list(iter_matching_tweets(make_tweet, query, file_name, progress))
+
+def iter_matching_tweets(make_tweet, query, file_name='tweets2011.txt', progress=None):
+    """Yield the tweets in file_name that match query one at a time, as
+    load_matching_tweets returns them, without holding them all in memory."""
+    tree = parse(query)
+    _, predicate = compile_query(tree)
+    literals = required_literals(tree)
+    path = scan_path(query, file_name)
+    meter = progress and Progress('Matching "{0}"'.format(query), progress, scan_size(path))
+    if literals:
+        corpus = open_corpus(path, binary=True)
+        lines = matching_lines(corpus, max(literals, key=len), re.compile(''), meter)
+    else:
+        corpus = lines = open_corpus(path)
+        if meter:
+            meter.position = corpus.buffer.tell
+    matched, scanned = 0, 0
+    try:
+        with corpus:
+            for line in lines:
+                scanned += 1
+                if meter and not literals and not scanned % LINES_PER_UPDATE:
+                    meter.update(lines=scanned, matches=matched)
+                fields = split_tweet_line(line)
+                if fields is None:
+                    continue
+                lat, lon, time_text, text = fields
+                text = text.lower()
+                if predicate((lat, lon, time_text, text)):
+                    time = datetime.strptime(time_text, TIME_FORMAT)
+                    matched += 1
+                    yield make_tweet(text, time, lat, lon)
+        if meter:
+            meter.update(lines=meter.lines if literals else scanned, matches=matched)
+            meter.finish()
+    finally:
+        count('tweets parsed', matched)
+        count('tweets dropped', scanned - matched)
@@ -0,0 +1,296 @@
+"""The raster module implements a headless Canvas that renders to PNG files.
+
+RasterCanvas supports the drawing primitives of graphics.Canvas that the map
+drawing functions use, but paints into an in-memory RGB pixel buffer instead
+of a Tk window.  Polygons and circles are filled with a scanline algorithm and
+the buffer is written as a PNG image using only zlib.
+"""
+
+import struct
+import zlib
+from headless import HeadlessCanvas
+
+# Named colors accepted in addition to '#RRGGBB' strings
+COLOR_NAMES = {'white': (255, 255, 255), 'black': (0, 0, 0),
+               'red': (255, 0, 0), 'green': (0, 128, 0), 'blue': (0, 0, 255),
+               'gray': (190, 190, 190), 'grey': (190, 190, 190)}
+
+# A 5x7 bitmap font; each glyph is seven rows of five bits, high bit on the left
+FONT = {
+    'A': (14, 17, 17, 31, 17, 17, 17), 'B': (30, 17, 17, 30, 17, 17, 30),
+    'C': (14, 17, 16, 16, 16, 17, 14), 'D': (30, 17, 17, 17, 17, 17, 30),
+    'E': (31, 16, 16, 30, 16, 16, 31), 'F': (31, 16, 16, 30, 16, 16, 16),
+    'G': (14, 17, 16, 23, 17, 17, 15), 'H': (17, 17, 17, 31, 17, 17, 17),
+    'I': (14, 4, 4, 4, 4, 4, 14), 'J': (7, 2, 2, 2, 2, 18, 12),
+    'K': (17, 18, 20, 24, 20, 18, 17), 'L': (16, 16, 16, 16, 16, 16, 31),
+    'M': (17, 27, 21, 21, 17, 17, 17), 'N': (17, 17, 25, 21, 19, 17, 17),
+    'O': (14, 17, 17, 17, 17, 17, 14), 'P': (30, 17, 17, 30, 16, 16, 16),
+    'Q': (14, 17, 17, 17, 21, 18, 13), 'R': (30, 17, 17, 30, 20, 18, 17),
+    'S': (15, 16, 16, 14, 1, 1, 30), 'T': (31, 4, 4, 4, 4, 4, 4),
+    'U': (17, 17, 17, 17, 17, 17, 14), 'V': (17, 17, 17, 17, 17, 10, 4),
+    'W': (17, 17, 17, 21, 21, 21, 10), 'X': (17, 17, 10, 4, 10, 17, 17),
+    'Y': (17, 17, 10, 4, 4, 4, 4), 'Z': (31, 1, 2, 4, 8, 16, 31),
+    '0': (14, 17, 19, 21, 25, 17, 14), '1': (4, 12, 4, 4, 4, 4, 14),
+    '2': (14, 17, 1, 2, 4, 8, 31), '3': (31, 2, 4, 2, 1, 17, 14),
+    '4': (2, 6, 10, 18, 31, 2, 2), '5': (31, 16, 30, 1, 1, 17, 14),
+    '6': (6, 8, 16, 30, 17, 17, 14), '7': (31, 1, 2, 4, 8, 8, 8),
+    '8': (14, 17, 17, 14, 17, 17, 14), '9': (14, 17, 17, 15, 1, 2, 12),
+    ' ': (0, 0, 0, 0, 0, 0, 0), '-': (0, 0, 0, 31, 0, 0, 0),
+    ':': (0, 12, 12, 0, 12, 12, 0), '.': (0, 0, 0, 0, 0, 12, 12),
+}
+GLYPH_WIDTH, GLYPH_HEIGHT = 5, 7
+
+class RasterCanvas(HeadlessCanvas):
+    """A Canvas that draws into an RGB pixel buffer and saves PNG images.
+
+    draw_* methods return an id number for each shape, like graphics.Canvas.
+    Polygons and text are remembered so that they can be edited or cleared by
+    tag; circles are only painted into the buffer, so editing a shape or
+    clearing any tag removes them all.
+    """
+
+    def __init__(self, width=1024, height=768, title='', color='White'):
+        HeadlessCanvas.__init__(self, width, height, title, color)
+        self._pixels = bytearray(width * height * 3)
+        self._shapes = {}  # id -> (paint function, arguments list, tag), in order
+        self._draw_background()
+
+    def clear(self, shape='all'):
+        """Clear all shapes and text, or only those with the tag shape."""
+        if shape == 'all':
+            self._shapes = {}
+        else:
+            self._shapes = {id: s for id, s in self._shapes.items() if s[2] != shape}
+        self._repaint()
+
+    def draw_polygon(self, points, color='Black', fill_color=None, filled=1, smooth=0, width=1, tag=None):
+        """Draw a polygon and return its id.
+
+        points -- a list of (x, y) pairs encoding pixel positions
+        tag -- an optional name that clear(tag) uses to remove the shape
+        """
+        if fill_color == None:
+            fill_color = color
+        if filled == 0:
+            fill_color = None
+        return self._remember(self._paint_polygon, [points, color, fill_color, width], tag)
+
+    def draw_circle(self, center, radius, color='Black', fill_color=None, filled=1, width=1, tag=None):
+        """Draw a circle and return its id.
+
+        center -- an (x, y) pair encoding a pixel position
+        """
+        if fill_color == None:
+            fill_color = color
+        if color and width:
+            self._fill_circle(center, radius, parse_color(color))
+            radius -= width
+        if filled:
+            self._fill_circle(center, radius, parse_color(fill_color))
+        return self._new_id()
+
+    def draw_text(self, text, pos, color='Black', font='Arial',
+                  size=12, style='normal', anchor='nw'):
+        """Draw text with a built-in bitmap font and return its id.
+
+        Characters without a glyph (including lowercase letters, which are
+        drawn as uppercase) are left blank.
+        """
+        return self._remember(self._paint_text, [text, pos, color, size, anchor], None)
+
+    def edit_text(self, id, text=None, color=None, font=None, size=12,
+                  style='normal'):
+        """Edit the text or color of an existing text object.
+
+        The buffer is repainted from the remembered polygons and text, which
+        removes any circles.
+        """
+        arguments = self._shapes[id][1]
+        if text is not None:
+            arguments[0] = text
+        if color is not None:
+            arguments[2] = color
+        if font is not None:
+            arguments[3] = size
+        self._repaint()
+
+    def edit_shape(self, id, color=None, fill_color=None):
+        """Edit the outline or fill color of an existing polygon.
+
+        Like edit_text, this repaints the buffer and removes any circles.
+        """
+        arguments = self._shapes[id][1]
+        if color is not None:
+            arguments[1] = color
+        if fill_color is not None:
+            arguments[2] = fill_color
+        self._repaint()
+
+    def edit_shapes(self, edits):
+        """Recolor many polygons, repainting the buffer once.
+
+        edits -- a sequence of (id, fill_color) pairs
+        """
+        for id, fill_color in edits:
+            self._shapes[id][1][2] = fill_color
+        if edits:
+            self._repaint()
+
+    def save(self, path):
+        """Write the pixel buffer to path as a PNG image."""
+        with open(path, 'wb') as out:
+            out.write(png_bytes(self._pixels, self.width, self.height))
+
+    def _repaint(self):
+        self._draw_background()
+        for paint, arguments, _ in self._shapes.values():
+            paint(*arguments)
+
+    def _remember(self, paint, arguments, tag):
+        id = self._new_id()
+        self._shapes[id] = (paint, arguments, tag)
+        paint(*arguments)
+        return id
+
+    def _paint_polygon(self, points, color, fill_color, width):
+        if fill_color:
+            rgb = parse_color(fill_color)
+            for y, x0, x1 in polygon_spans(points, self.height):
+                self._fill_span(y, x0, x1, rgb)
+        if color and width:
+            rgb = parse_color(color)
+            closed = list(points) + [points[0]]
+            for start, end in zip(closed, closed[1:]):
+                self._draw_line(start, end, rgb)
+
+    def _paint_text(self, text, pos, color, size, anchor):
+        scale = max(1, round(size / 10))
+        advance = (GLYPH_WIDTH + 1) * scale
+        x, y = pos
+        text_width, text_height = advance * len(text) - scale, GLYPH_HEIGHT * scale
+        if anchor == 'center':
+            anchor = ''
+        if 'e' in anchor:
+            x -= text_width
+        elif 'w' not in anchor:
+            x -= text_width / 2
+        if 's' in anchor:
+            y -= text_height
+        elif 'n' not in anchor:
+            y -= text_height / 2
+        x, y = int(round(x)), int(round(y))
+        rgb = parse_color(color)
+        for index, char in enumerate(text.upper()):
+            rows = FONT.get(char, FONT[' '])
+            left = x + index * advance
+            for row, bits in enumerate(rows):
+                for col in range(GLYPH_WIDTH):
+                    if bits & (1 << (GLYPH_WIDTH - 1 - col)):
+                        top = y + row * scale
+                        for dy in range(scale):
+                            self._fill_span(top + dy, left + col * scale,
+                                            left + (col + 1) * scale - 1, rgb)
+
+    def _draw_background(self):
+        rgb = bytes(parse_color(self.color))
+        self._pixels[:] = rgb * (self.width * self.height)
+
+    def _fill_span(self, y, x0, x1, rgb):
+        """Fill pixels x0 through x1 (inclusive) of row y."""
+        if y < 0 or y >= self.height:
+            return
+        x0, x1 = max(x0, 0), min(x1, self.width - 1)
+        if x0 > x1:
+            return
+        start = (y * self.width + x0) * 3
+        self._pixels[start:start + (x1 - x0 + 1) * 3] = bytes(rgb) * (x1 - x0 + 1)
+
+    def _fill_circle(self, center, radius, rgb):
+        if radius <= 0:
+            return
+        cx, cy = center
+        for y in range(int(cy - radius), int(cy + radius) + 1):
+            dy = y + 0.5 - cy
+            if abs(dy) <= radius:
+                dx = (radius * radius - dy * dy) ** 0.5
+                self._fill_span(y, int(round(cx - dx)), int(round(cx + dx)) - 1, rgb)
+
+    def _draw_line(self, start, end, rgb):
+        """Draw a one-pixel line with Bresenham's algorithm."""
+        x0, y0 = int(round(start[0])), int(round(start[1]))
+        x1, y1 = int(round(end[0])), int(round(end[1]))
+        dx, dy = abs(x1 - x0), -abs(y1 - y0)
+        sx, sy = (1 if x0 < x1 else -1), (1 if y0 < y1 else -1)
+        error = dx + dy
+        while True:
+            self._fill_span(y0, x0, x0, rgb)
+            if x0 == x1 and y0 == y1:
+                return
+            double = 2 * error
+            if double >= dy:
+                error += dy
+                x0 += sx
+            if double <= dx:
+                error += dx
+                y0 += sy
+
+def polygon_spans(points, height):
+    """Yield (y, x0, x1) pixel spans that fill a polygon, using the even-odd
+    rule and sampling each row at its center.
+
+    >>> list(polygon_spans([(0, 0), (4, 0), (4, 2), (0, 2)], 10))
+    [(0, 0, 3), (1, 0, 3)]
+    """
+    edges = []
+    for (x0, y0), (x1, y1) in zip(points, list(points[1:]) + [points[0]]):
+        if y0 == y1:
+            continue
+        if y0 > y1:
+            x0, y0, x1, y1 = x1, y1, x0, y0
+        edges.append((y0, y1, x0, (x1 - x0) / (y1 - y0)))
+    if not edges:
+        return
+    edges.sort()
+    top = max(0, int(edges[0][0]))
+    bottom = min(height - 1, int(max(e[1] for e in edges)))
+    active, next_edge = [], 0
+    for y in range(top, bottom + 1):
+        sample = y + 0.5
+        while next_edge < len(edges) and edges[next_edge][0] <= sample:
+            active.append(edges[next_edge])
+            next_edge += 1
+        active = [e for e in active if e[1] > sample]
+        crossings = sorted(x + (sample - y0) * slope
+                           for y0, y1, x, slope in active if y0 <= sample)
+        for left, right in zip(crossings[::2], crossings[1::2]):
+            x0, x1 = int(left + 0.5), int(right + 0.5) - 1
+            if x0 <= x1:
+                yield y, x0, x1
+
+def parse_color(color):
+    """Return an (r, g, b) tuple for a '#RRGGBB' string or a color name.
+
+    >>> parse_color('#FF8000')
+    (255, 128, 0)
+    >>> parse_color('White')
+    (255, 255, 255)
+    """
+    if color.startswith('#') and len(color) == 7:
+        return tuple(int(color[i:i+2], 16) for i in (1, 3, 5))
+    return COLOR_NAMES[color.lower()]
+
+def png_bytes(pixels, width, height):
+    """Return the contents of a PNG file for an RGB pixel buffer."""
+    stride = width * 3
+    raw = bytearray()
+    for y in range(height):
+        raw.append(0)  # filter type: none
+        raw += pixels[y * stride:(y + 1) * stride]
+
+    def chunk(kind, data):
+        body = kind + data
+        return struct.pack('>I', len(data)) + body + struct.pack('>I', zlib.crc32(body))
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) +
+            chunk(b'IDAT', zlib.compress(bytes(raw), 6)) + chunk(b'IEND', b''))
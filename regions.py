@@ -0,0 +1,279 @@
+"""Sets of named map regions, such as states or counties.
+
+A RegionSet holds the outline of each region and precomputes its center,
+bounding box, and a spatial index of the boxes, so that finding the region
+that contains a position only tests the few regions whose boxes overlap
+the position's index cell.  Centers are indexed too, by
+the cells of a grid over points on the unit sphere, so that finding the
+closest center to a position only measures the distance to nearby centers.
+The cost of a lookup therefore stays about the same from fifty states to
+thousands of counties.
+
+Regions that cross the antimeridian, such as Alaska with the western
+Aleutians, are indexed with longitudes east of it shifted by -360 degrees
+(by geo.shift_longitude, as in stategrid.py), so that their boxes stay
+small.  Holes in GeoJSON polygons are ignored: a position in a hole belongs
+to the region around it.
+
+Region sets are loaded from GeoJSON files (a FeatureCollection of Polygon
+and MultiPolygon features) or from files in the format of states.json:
+
+  python3 trends.py -m texas --regions data/counties.json
+"""
+
+import hashlib
+import json
+import os
+from itertools import product
+from math import floor, sqrt, sin, cos, radians
+try:
+    import numpy
+except ImportError:
+    numpy = None
+from geo import (make_position, latitude, longitude, point_in_polygon, nearest,
+                 load_states, geo_distance, shift_longitude)
+
+# Index cells cover about this many region bounding boxes on average
+REGIONS_PER_CELL = 4
+# Region sets with more regions than this find nearest centers with an index
+# instead of measuring the distance to every center
+INDEXED_NEAREST_MIN_REGIONS = 256
+MAX_CENTER_SHELLS = 3
+NAME_PROPERTIES = ('name', 'NAME', 'id', 'GEOID')
+
+class RegionSet(object):
+    """Named regions, each a list of polygons of positions.
+
+    >>> square = [make_position(0, 0), make_position(0, 2), make_position(2, 2), make_position(2, 0)]
+    >>> east = [make_position(0, 2), make_position(0, 4), make_position(2, 4), make_position(2, 2)]
+    >>> regions = RegionSet({'W': [square], 'E': [east]})
+    >>> regions.region_at(make_position(1, 3)), regions.region_at(make_position(5, 5))
+    ('E', None)
+    >>> regions.assign([make_position(1, 1), make_position(5, 5)], 'contain')
+    ['W', 'E']
+    >>> aleutians = [make_position(50, 170), make_position(50, -170), make_position(55, -170), make_position(55, 170)]
+    >>> islands = RegionSet({'AK': [aleutians]})
+    >>> islands.bounds['AK'], islands.region_at(make_position(52, 179))
+    ((50, -190, 55, -170), 'AK')
+    >>> islands.key == RegionSet({'AK': [aleutians]}).key != regions.key
+    True
+    """
+
+    def __init__(self, shapes, centers=None, key=None, lookup=None):
+        """shapes -- a dictionary from region names to lists of polygons
+        centers -- an optional dictionary from names to center positions;
+                   by default each center is the area-weighted centroid
+        key -- a JSON-serializable identifier, used in cache keys; by
+               default a digest of the shapes and centers
+        lookup -- an optional faster replacement for region_at
+        """
+        self.shapes = shapes
+        self.names = list(shapes)
+        self.key = key
+        self._lookup = lookup
+        self._shifted = {}  # name -> polygons, for regions that cross the antimeridian
+        self.bounds = {}  # name -> (south, west, north, east), with shifted longitudes
+        for name, polygons in shapes.items():
+            lons = [longitude(p) for polygon in polygons for p in polygon]
+            if max(lons) - min(lons) > 180:
+                polygons = self._shifted[name] = [[make_position(latitude(p), shift_longitude(longitude(p)))
+                                                   for p in polygon] for polygon in polygons]
+                lons = [longitude(p) for polygon in polygons for p in polygon]
+            lats = [latitude(p) for polygon in polygons for p in polygon]
+            self.bounds[name] = (min(lats), min(lons), max(lats), max(lons))
+        self.centers = centers or {name: _unshift(region_center(self._shifted.get(name, s)))
+                                   for name, s in shapes.items()}
+        if self.key is None:
+            self.key = _digest(shapes, self.centers)
+        self._build_index()
+        self._build_center_index()
+
+    def __len__(self):
+        return len(self.names)
+
+    def _build_index(self):
+        """Bucket the regions by the index cells that their boxes overlap."""
+        boxes = self.bounds.values()
+        mean_area = sum((n - s) * (e - w) for s, w, n, e in boxes) / max(len(boxes), 1)
+        self._cell_size = max(sqrt(mean_area * REGIONS_PER_CELL), 1e-6)
+        self._cells = {}
+        for name, (south, west, north, east) in self.bounds.items():
+            for row in range(self._cell(south), self._cell(north) + 1):
+                for col in range(self._cell(west), self._cell(east) + 1):
+                    self._cells.setdefault((row, col), []).append(name)
+
+    def _cell(self, degrees):
+        return int(floor(degrees / self._cell_size))
+
+    def _build_center_index(self):
+        """Bucket the region centers by cells of a grid in three dimensions,
+        which they occupy as points on the unit sphere."""
+        # About the spacing of the centers, as a chord of the unit sphere
+        self._center_size = radians(self._cell_size / sqrt(REGIONS_PER_CELL))
+        self._vectors = [_unit_vector(self.centers[name]) for name in self.names]
+        self._vector_array = None  # The vectors as a NumPy array, once needed
+        self._center_cells = {}
+        for index, vector in enumerate(self._vectors):
+            self._center_cells.setdefault(self._center_cell(vector), []).append(index)
+
+    def _center_cell(self, vector):
+        return tuple(int(floor(c / self._center_size)) for c in vector)
+
+    def _nearest_center(self, position):
+        """Return the index of the closest center to position, preferring the
+        first of equally close centers, by searching ever larger shells of
+        center cells around the cell of position.
+
+        Every center in a cell beyond shell k is more than k cells away along
+        some axis, and so at least k cell widths from position.  The search
+        stops once the closest center found is no farther than that.  Chord
+        lengths order centers as great circle distances do, so geo_distance
+        only breaks near-ties among the closest.  For a position more than
+        MAX_CENTER_SHELLS cells from every center, outside the area that the
+        regions cover, every center is measured instead.
+        """
+        vector = _unit_vector(position)
+        x, y, z = self._center_cell(vector)
+        chords = []  # (chord length, index) for each center searched
+        k = 0
+        while k <= MAX_CENTER_SHELLS:
+            for dx, dy, dz in _shell(k):
+                for index in self._center_cells.get((x + dx, y + dy, z + dz), ()):
+                    chords.append((_chord(vector, self._vectors[index]), index))
+            if chords and min(chords)[0] < k * self._center_size * (1 - 1e-9):
+                break
+            k += 1
+        else:
+            chords = self._all_chords(vector)
+        closest = min(chords)[0] * (1 + 1e-9)
+        return min((geo_distance(position, self.centers[self.names[index]]), index)
+                   for chord, index in chords if chord <= closest)[1]
+
+    def _all_chords(self, vector):
+        """Return (chord length, index) for the centers closest to vector."""
+        if numpy is None:
+            return [(_chord(vector, v), index) for index, v in enumerate(self._vectors)]
+        if self._vector_array is None:
+            self._vector_array = numpy.array(self._vectors)
+        lengths = numpy.sqrt(((self._vector_array - vector) ** 2).sum(axis=1))
+        closest = lengths.min() * (1 + 1e-9)
+        return [(float(lengths[i]), int(i)) for i in numpy.flatnonzero(lengths <= closest)]
+
+    def region_at(self, position):
+        """Return the name of the region that contains position, or None."""
+        lat = latitude(position)
+        for lon in {longitude(position), shift_longitude(longitude(position))}:
+            for name in self._cells.get((self._cell(lat), self._cell(lon)), ()):
+                south, west, north, east = self.bounds[name]
+                if (south <= lat <= north and west <= lon <= east and
+                        any(point_in_polygon(make_position(lat, lon), p)
+                            for p in self._shifted.get(name, self.shapes[name]))):
+                    return name
+        return None
+
+    def nearest_centers(self, positions):
+        """Return the name of the region with the closest center to each position."""
+        if len(self.names) >= INDEXED_NEAREST_MIN_REGIONS:
+            closest = [self._nearest_center(position) for position in positions]
+        else:
+            closest = nearest(positions, [self.centers[name] for name in self.names])
+        return [self.names[index] for index in closest]
+
+    def assign(self, positions, mode='center'):
+        """Return a region name for each position: the region with the closest
+        center in 'center' mode, or the region that contains it in 'contain'
+        mode, falling back to the closest center outside every region."""
+        if mode == 'center':
+            return self.nearest_centers(positions)
+        names = list(map(self._lookup or self.region_at, positions))
+        unplaced = [i for i, name in enumerate(names) if name is None]
+        for i, name in zip(unplaced, self.nearest_centers([positions[i] for i in unplaced])):
+            names[i] = name
+        return names
+
+def _unit_vector(position):
+    lat, lon = radians(latitude(position)), radians(longitude(position))
+    return cos(lat) * cos(lon), cos(lat) * sin(lon), sin(lat)
+
+def _unshift(position):
+    lon = longitude(position)
+    return make_position(latitude(position), lon + 360 if lon < -180 else lon)
+
+def _digest(shapes, centers):
+    """Return a string identifying regions with these shapes and centers."""
+    text = json.dumps([sorted(shapes.items()), sorted(centers.items())])
+    return hashlib.sha1(text.encode('utf8')).hexdigest()
+
+def _chord(u, v):
+    return sqrt((u[0] - v[0]) ** 2 + (u[1] - v[1]) ** 2 + (u[2] - v[2]) ** 2)
+
+_shells = {}
+
+def _shell(k):
+    """Return the offsets of the cells exactly k cells away in three dimensions."""
+    if k not in _shells:
+        _shells[k] = [d for d in product(range(-k, k + 1), repeat=3) if max(map(abs, d)) == k]
+    return _shells[k]
+
+def region_center(polygons):
+    """Return the centroid of polygons, weighted by their areas, treating
+    latitude and longitude as planar coordinates."""
+    total_area = lat_sum = lon_sum = 0
+    for polygon in polygons:
+        area = lat = lon = 0
+        for p, q in zip(polygon, polygon[1:] + polygon[:1]):
+            cross = latitude(p) * longitude(q) - latitude(q) * longitude(p)
+            area += cross / 2
+            lat += (latitude(p) + latitude(q)) * cross
+            lon += (longitude(p) + longitude(q)) * cross
+        if area:
+            total_area += abs(area)
+            lat_sum += lat / (6 * area) * abs(area)
+            lon_sum += lon / (6 * area) * abs(area)
+    if not total_area:
+        return polygons[0][0]
+    return make_position(lat_sum / total_area, lon_sum / total_area)
+
+def _rings(geometry):
+    """Return the outer rings of a GeoJSON Polygon or MultiPolygon as lists
+    of positions.  Holes are ignored."""
+    if geometry['type'] == 'Polygon':
+        polygons = [geometry['coordinates']]
+    elif geometry['type'] == 'MultiPolygon':
+        polygons = geometry['coordinates']
+    else:
+        return []
+    rings = []
+    for polygon in polygons:
+        ring = polygon[0]
+        if len(ring) > 1 and ring[0] == ring[-1]:
+            ring = ring[:-1]  # GeoJSON repeats the first position at the end
+        rings.append([make_position(lat, lon) for lon, lat in ring])
+    return rings
+
+def _feature_name(feature, name_property):
+    properties = feature.get('properties') or {}
+    if name_property:
+        return str(properties[name_property])
+    for key in NAME_PROPERTIES:
+        if key in properties:
+            return str(properties[key])
+    return str(feature['id'])
+
+def load_regions(path, name_property=None):
+    """Load a RegionSet from a GeoJSON FeatureCollection or a file in the
+    format of states.json.  Region names come from the name_property of
+    each feature, or else its first property in NAME_PROPERTIES, or its id.
+    """
+    with open(path, encoding='utf8') as region_file:
+        data = json.load(region_file)
+    if data.get('type') == 'FeatureCollection':
+        shapes = {}
+        for feature in data['features']:
+            rings = _rings(feature['geometry'] or {'type': None})
+            if rings:
+                shapes.setdefault(_feature_name(feature, name_property), []).extend(rings)
+    else:
+        shapes = load_states(path)
+    stat = os.stat(path)
+    return RegionSet(shapes, key=[os.path.abspath(path), stat.st_size, stat.st_mtime_ns])
@@ -0,0 +1,184 @@
+"""A long-running query server that keeps the Trends data warm in memory.
+
+The sentiment lexicon, state shapes, and state centers are loaded once when
+the server starts, and the results of the MAX_RESULTS most recent queries are
+kept in memory (backed by the on-disk result cache), so repeated queries are
+answered without rescanning the corpus.  Results are keyed like the on-disk
+cache, so a changed tweets file or lexicon is never answered from memory.
+
+Start a server and query it:
+  python3 trends.py --serve localhost:8061
+  python3 server.py --term texas --tweets_file tweets2011.txt
+
+Or with curl:
+  curl 'http://localhost:8061/sentiments?term=texas'
+
+While a query runs, /progress?term=texas returns the latest progress report
+of its scan (see progress.py).
+
+The address may also be the path of a Unix socket.  Options given to
+trends.py with --serve, such as --scoring and --regions, apply to every query.
+"""
+
+import asyncio
+import json
+import socket
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qs, urlencode
+from query import canonical_term, is_query, parse
+from ucb import main
+
+DEFAULT_ADDRESS = 'localhost:8061'
+MAX_RESULTS = 256
+
+class QueryServer(object):
+    """Answers sentiment-by-state queries from warm in-memory indexes."""
+
+    def __init__(self, trends=None, assign='center', regions=None, scoring='words'):
+        """trends -- the trends module to answer with, such as the __main__
+                  module whose command-line options were applied; by default
+                  it is imported
+        assign, regions, scoring -- options for every query, as for
+                                    trends.analyze_query
+        """
+        if trends is None:
+            import trends
+        self._trends = trends
+        self._options = {'assign': assign, 'regions': regions, 'scoring': scoring}
+        trends.state_centers()  # Build the state centers before any query
+        self._results = OrderedDict()  # cache key -> response, least recently used first
+        self._pending = {}   # (term, file name) -> future for a running query
+        self._progress = {}  # (term, file name) -> latest progress status
+
+    def query(self, term, file_name):
+        """Return the response dictionary for term in file_name."""
+        key = (term, file_name)
+        report = lambda status: self._progress.__setitem__(key, status)
+        try:
+            result = self._trends.analyze_query(term, file_name, progress=report, **self._options)
+        finally:
+            self._progress.pop(key, None)
+        return {'term': term, 'tweets_file': file_name, 'tweets': result['tweets'],
+                'state_sentiments': result['state_sentiments']}
+
+    async def answer(self, term, file_name):
+        """Return the response for a query, computing it at most once even
+        when many clients ask for the same query concurrently."""
+        result = self.recent_result(term, file_name)
+        if result is not None:
+            return result
+        key = (canonical_term(term), file_name)
+        if key not in self._pending:
+            loop = asyncio.get_running_loop()
+            self._pending[key] = loop.run_in_executor(None, self.query, *key)
+        try:
+            result = await self._pending[key]
+        finally:
+            self._pending.pop(key, None)
+        self._results[self._result_key(term, file_name)] = result
+        while len(self._results) > MAX_RESULTS:
+            self._results.popitem(last=False)
+        return result
+
+    def _result_key(self, term, file_name):
+        return json.dumps(self._trends.query_key(term, file_name, **self._options))
+
+    def recent_result(self, term, file_name):
+        """Return the response for a recent query that is still current, or None."""
+        key = self._result_key(term, file_name)
+        if key not in self._results:
+            return None
+        self._results.move_to_end(key)
+        return self._results[key]
+
+    async def handle(self, reader, writer):
+        """Respond to one HTTP request on a connection."""
+        try:
+            request_line = (await reader.readline()).decode('latin-1')
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass  # Skip request headers
+            status, body = await self.respond(request_line)
+        except Exception as e:
+            status, body = '500 Internal Server Error', {'error': str(e)}
+        payload = json.dumps(body).encode('utf8')
+        writer.write('HTTP/1.0 {0}\r\nContent-Type: application/json\r\n'
+                     'Content-Length: {1}\r\n\r\n'.format(status, len(payload)).encode('latin-1'))
+        writer.write(payload)
+        await writer.drain()
+        writer.close()
+        await writer.wait_closed()
+
+    async def respond(self, request_line):
+        """Return an HTTP status and a JSON-serializable body for a request."""
+        parts = request_line.split()
+        if len(parts) < 2 or parts[0] != 'GET':
+            return '405 Method Not Allowed', {'error': 'Only GET is supported'}
+        url = urlsplit(parts[1])
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if url.path not in ('/sentiments', '/progress') or 'term' not in params:
+            return '404 Not Found', {'error': 'Use /sentiments?term=...&file=...'}
+        try:
+            if is_query(params['term']):
+                parse(params['term'])
+        except ValueError as e:
+            return '400 Bad Request', {'error': str(e)}
+        if url.path == '/progress':
+            key = (canonical_term(params['term']), params.get('file', 'tweets2011.txt'))
+            if key not in self._pending and self.recent_result(*key) is not None:
+                return '200 OK', {'done': True}
+            return '200 OK', self._progress.get(key, {'done': False, 'running': key in self._pending})
+        result = await self.answer(params['term'], params.get('file', 'tweets2011.txt'))
+        return '200 OK', result
+
+async def _serve_forever(address, options):
+    server = QueryServer(**options)
+    if ':' in address:
+        host, port = address.rsplit(':', 1)
+        listener = await asyncio.start_server(server.handle, host, int(port))
+    else:
+        listener = await asyncio.start_unix_server(server.handle, address)
+    print('Serving Trends queries at {0}'.format(address))
+    async with listener:
+        await listener.serve_forever()
+
+def serve(address=DEFAULT_ADDRESS, **options):
+    """Serve queries at address, either host:port or a Unix socket path.
+
+    options -- keyword arguments for QueryServer
+    """
+    try:
+        asyncio.run(_serve_forever(address, options))
+    except KeyboardInterrupt:
+        pass
+
+def request(term, file_name='tweets2011.txt', address=DEFAULT_ADDRESS):
+    """Send a query to a running server and return its decoded JSON response."""
+    if ':' in address:
+        host, port = address.rsplit(':', 1)
+        connection = socket.create_connection((host, int(port)))
+    else:
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(address)
+    query = urlencode({'term': term, 'file': file_name})
+    with connection:
+        connection.sendall('GET /sentiments?{0} HTTP/1.0\r\n\r\n'.format(query).encode('latin-1'))
+        response = b''.join(iter(lambda: connection.recv(1 << 16), b''))
+    _, _, body = response.partition(b'\r\n\r\n')
+    return json.loads(body.decode('utf8'))
+
+@main
+def run(*args):
+    """Query a running server and print the state sentiments it returns."""
+    import argparse
+    parser = argparse.ArgumentParser(description="Query a Trends server")
+    parser.add_argument('--term', '-m', type=str, required=True)
+    parser.add_argument('--tweets_file', '-t', type=str, default='tweets2011.txt')
+    parser.add_argument('--address', '-a', type=str, default=DEFAULT_ADDRESS)
+    args = parser.parse_args()
+    response = request(args.term, args.tweets_file, args.address)
+    if 'error' in response:
+        print('Error: ' + response['error'])
+        return
+    print('{0} tweets contain "{1}"'.format(response['tweets'], response['term']))
+    for name, sentiment in sorted(response['state_sentiments'].items()):
+        print('{0}: {1:+.4f}'.format(name, sentiment))
@@ -0,0 +1,186 @@
+"""Fixed-memory sketches for summarizing streams of tweets.
+
+QuantileSketch estimates quantiles of a stream of numbers (a KLL sketch), and
+TopKSketch estimates the most frequent items in a stream (a Space-Saving
+sketch).  Each uses memory bounded by its size parameter no matter how long
+the stream is.  Sketches of the same kind can be merged, so separate worker
+processes can each summarize part of a corpus and combine their results; the
+to_dict and from_dict methods convert sketches to and from JSON-serializable
+dictionaries for passing them between processes.
+"""
+
+import random
+from math import ceil
+
+class QuantileSketch(object):
+    """A KLL sketch of a stream of numbers, which keeps O(k) of them.
+
+    >>> sketch = QuantileSketch(k=50, seed=0)
+    >>> for i in range(10000):
+    ...     sketch.update(i / 10000)
+    >>> sketch.count
+    10000
+    >>> abs(sketch.quantile(0.5) - 0.5) < 0.05
+    True
+    >>> len(sketch) < 300
+    True
+    """
+
+    def __init__(self, k=200, seed=None):
+        self.k = k
+        self.count = 0
+        self.compactors = [[]]
+        self._random = random.Random(seed)
+        self._size = 0
+        self._max_size = self._capacity(0)
+
+    def __len__(self):
+        """Return the number of values the sketch keeps."""
+        return self._size
+
+    def _capacity(self, height):
+        depth = len(self.compactors) - height - 1
+        return max(2, int(ceil(self.k * (2 / 3) ** depth)))
+
+    def update(self, value):
+        """Add a value to the sketch."""
+        self.compactors[0].append(value)
+        self._size += 1
+        self.count += 1
+        if self._size >= self._max_size:
+            self._compress()
+
+    def merge(self, other):
+        """Add the values summarized by another sketch to this one."""
+        while len(self.compactors) < len(other.compactors):
+            self.compactors.append([])
+        for compactor, values in zip(self.compactors, other.compactors):
+            compactor.extend(values)
+        self.count += other.count
+        self._size = sum(len(c) for c in self.compactors)
+        self._max_size = sum(self._capacity(h) for h in range(len(self.compactors)))
+        while self._size >= self._max_size:
+            self._compress()
+        return self
+
+    def _compress(self):
+        """Halve the first full compactor, promoting every other value."""
+        for height, compactor in enumerate(self.compactors):
+            if len(compactor) >= self._capacity(height):
+                if height + 1 == len(self.compactors):
+                    self.compactors.append([])
+                compactor.sort()
+                kept = [compactor.pop()] if len(compactor) % 2 else []
+                promoted = compactor[self._random.getrandbits(1)::2]
+                self.compactors[height + 1].extend(promoted)
+                self._size -= len(compactor) - len(promoted)
+                compactor[:] = kept
+                break
+        self._max_size = sum(self._capacity(h) for h in range(len(self.compactors)))
+
+    def quantiles(self, fractions):
+        """Return estimates of the values at each of the given fractions
+        (between 0 and 1) of the way through the stream, in sorted order."""
+        weighted = sorted((value, 2 ** height)
+                          for height, compactor in enumerate(self.compactors)
+                          for value in compactor)
+        if not weighted:
+            return [None for _ in fractions]
+        total = sum(weight for _, weight in weighted)
+        results = []
+        for fraction in fractions:
+            target, seen = fraction * total, 0
+            for value, weight in weighted:
+                seen += weight
+                if seen >= target:
+                    break
+            results.append(value)
+        return results
+
+    def quantile(self, fraction):
+        """Return an estimate of the value fraction of the way through the stream."""
+        return self.quantiles([fraction])[0]
+
+    def to_dict(self):
+        return {'k': self.k, 'count': self.count, 'compactors': self.compactors}
+
+    @classmethod
+    def from_dict(cls, d):
+        sketch = cls(d['k'])
+        sketch.compactors = [list(c) for c in d['compactors']]
+        sketch.count = d['count']
+        sketch._size = sum(len(c) for c in sketch.compactors)
+        sketch._max_size = sum(sketch._capacity(h) for h in range(len(sketch.compactors)))
+        return sketch
+
+class TopKSketch(object):
+    """A Space-Saving sketch of the most frequent items in a stream, which
+    keeps counts for at most capacity items.
+
+    Each estimated count is at least the true count, and over-counts by at
+    most the number of items in the stream divided by capacity.
+
+    >>> sketch = TopKSketch(capacity=3)
+    >>> for word in 'a b a c a b d a b e'.split():
+    ...     sketch.update(word)
+    >>> sketch.top(2)
+    [('a', 4), ('b', 3)]
+    """
+
+    def __init__(self, capacity=100):
+        self.capacity = capacity
+        self.counts = {}
+
+    def __len__(self):
+        return len(self.counts)
+
+    def update(self, item, weight=1):
+        """Count weight occurrences of item."""
+        counts = self.counts
+        if item in counts:
+            counts[item] += weight
+        elif len(counts) < self.capacity:
+            counts[item] = weight
+        else:  # Replace the least frequent item, inheriting its count
+            least = min(counts, key=counts.get)
+            counts[item] = counts.pop(least) + weight
+
+    def merge(self, other):
+        """Add the counts summarized by another sketch to this one.
+
+        An item missing from a full sketch may have occurred up to that
+        sketch's smallest count times, so it is credited with that count.
+        """
+        floor = min(self.counts.values()) if len(self.counts) >= self.capacity else 0
+        other_floor = min(other.counts.values()) if len(other.counts) >= other.capacity else 0
+        merged = {}
+        for item in set(self.counts) | set(other.counts):
+            merged[item] = self.counts.get(item, floor) + other.counts.get(item, other_floor)
+        largest = sorted(merged.items(), key=lambda pair: (-pair[1], pair[0]))
+        self.counts = dict(largest[:self.capacity])
+        return self
+
+    def top(self, n=10):
+        """Return the n items with the largest counts, as (item, count) pairs."""
+        return sorted(self.counts.items(), key=lambda pair: (-pair[1], pair[0]))[:n]
+
+    def to_dict(self):
+        return {'capacity': self.capacity, 'counts': self.counts}
+
+    @classmethod
+    def from_dict(cls, d):
+        sketch = cls(d['capacity'])
+        sketch.counts = dict(d['counts'])
+        return sketch
+
+def merge_sketches(into, other):
+    """Merge a dictionary of sketches into another with the same structure,
+    such as one mapping state names to (QuantileSketch, TopKSketch) pairs.
+    Keys only present in other are added to into, which is returned."""
+    for key, sketches in other.items():
+        if key not in into:
+            into[key] = sketches
+        else:
+            for target, sketch in zip(into[key], sketches):
+                target.merge(sketch)
+    return into
@@ -0,0 +1,146 @@
+"""A precomputed raster of U.S. states for fast point-in-state lookups.
+
+The grid divides the latitude/longitude bounding box of all states into square
+cells of a fixed resolution in degrees, and stores one byte per cell: 0 for a
+cell outside every state, the number of a state for a cell inside it, or
+BOUNDARY for a cell crossed by a state outline.  Looking up a position reads
+one byte, and only positions in boundary cells are tested against the state
+polygons exactly.
+
+Grids are built once per resolution, cached in the data directory, and
+memory-mapped, so every process shares one copy of the cells.  A cached
+grid is rebuilt if states.json changes.
+
+Longitudes east of the antimeridian (the western Aleutians) are shifted by
+-360 degrees so that Alaska is contiguous.
+"""
+
+from math import floor, ceil
+from data import DATA_PATH, load_mapped_file
+from geo import us_states, point_in_polygon, shift_longitude
+
+DEFAULT_RESOLUTION = 0.05  # degrees
+BOUNDARY = 255
+
+def _polygons(shapes):
+    """Return polygons as lists of (lat, lon) pairs with shifted longitudes."""
+    return [[(lat, shift_longitude(lon)) for lat, lon in polygon] for polygon in shapes]
+
+def _edges(polygon):
+    return zip(polygon, polygon[1:] + polygon[:1])
+
+class StateGrid(object):
+    """A raster of state numbers over a latitude/longitude box.
+
+    >>> grid = load_grid()
+    >>> grid.state_at(38, -122), grid.state_at(42.5, -75), grid.state_at(30, -40)
+    ('CA', 'NY', None)
+    """
+
+    def __init__(self, header, cells):
+        self.south, self.west = header['south'], header['west']
+        self.rows, self.cols = header['rows'], header['cols']
+        self.resolution = header['resolution']
+        self.names = header['names']
+        self.cells = cells
+        self._offset = header.get('offset', 0)
+        self._bounds = []  # (south, west, north, east, name, polygons) for each state
+        for name in self.names:
+            polygons = _polygons(us_states[name])
+            lats = [lat for p in polygons for lat, _ in p]
+            lons = [lon for p in polygons for _, lon in p]
+            self._bounds.append((min(lats), min(lons), max(lats), max(lons), name, polygons))
+
+    def state_at(self, lat, lon):
+        """Return the name of the state containing (lat, lon), or None."""
+        lon = shift_longitude(lon)
+        row = int(floor((lat - self.south) / self.resolution))
+        col = int(floor((lon - self.west) / self.resolution))
+        if not (0 <= row < self.rows and 0 <= col < self.cols):
+            return None
+        cell = self.cells[self._offset + row * self.cols + col]
+        if cell == BOUNDARY:
+            for south, west, north, east, name, polygons in self._bounds:
+                if (south <= lat <= north and west <= lon <= east and
+                        any(point_in_polygon((lat, lon), p) for p in polygons)):
+                    return name
+            return None
+        return self.names[cell - 1] if cell else None
+
+def build_grid(resolution=DEFAULT_RESOLUTION):
+    """Rasterize us_states into a (header, cells) pair at resolution degrees.
+
+    Each cell whose center lies inside a state gets that state's number.  Then
+    every cell that a state outline passes through is marked BOUNDARY, since
+    it may lie partly in several states (or none).
+    """
+    names = sorted(us_states)
+    assert len(names) < BOUNDARY, 'Too many states for one byte per cell'
+    states = [_polygons(us_states[name]) for name in names]
+    lats = [lat for polygons in states for p in polygons for lat, _ in p]
+    lons = [lon for polygons in states for p in polygons for _, lon in p]
+    south, west = floor(min(lats)) - resolution, floor(min(lons)) - resolution
+    rows = int(ceil((max(lats) - south) / resolution)) + 1
+    cols = int(ceil((max(lons) - west) / resolution)) + 1
+    cells = bytearray(rows * cols)
+    for number, polygons in enumerate(states, 1):
+        for polygon in polygons:
+            _fill_interior(cells, polygon, number, south, west, rows, cols, resolution)
+    for polygons in states:
+        for polygon in polygons:
+            _mark_outline(cells, polygon, south, west, rows, cols, resolution)
+    header = {'south': south, 'west': west, 'rows': rows, 'cols': cols,
+              'resolution': resolution, 'names': names}
+    return header, cells
+
+def _fill_interior(cells, polygon, number, south, west, rows, cols, resolution):
+    """Set the cells whose centers lie inside polygon to number."""
+    lats = [lat for lat, _ in polygon]
+    first = max(0, int(floor((min(lats) - south) / resolution)))
+    last = min(rows - 1, int(ceil((max(lats) - south) / resolution)))
+    for row in range(first, last + 1):
+        y = south + (row + 0.5) * resolution
+        crossings = sorted(lon1 + (y - lat1) * (lon2 - lon1) / (lat2 - lat1)
+                           for (lat1, lon1), (lat2, lon2) in _edges(polygon)
+                           if (lat1 > y) != (lat2 > y))
+        for start, end in zip(crossings[::2], crossings[1::2]):
+            # Columns whose centers lie between the two crossings
+            low = max(0, int(ceil((start - west) / resolution - 0.5)))
+            high = min(cols, int(ceil((end - west) / resolution - 0.5)))
+            if low < high:
+                cells[row * cols + low:row * cols + high] = bytes([number]) * (high - low)
+
+def _mark_outline(cells, polygon, south, west, rows, cols, resolution):
+    """Mark every cell that an edge of polygon passes through as BOUNDARY."""
+    for (lat1, lon1), (lat2, lon2) in _edges(polygon):
+        if lat1 > lat2:
+            lat1, lon1, lat2, lon2 = lat2, lon2, lat1, lon1
+        first = int(floor((lat1 - south) / resolution))
+        last = int(floor((lat2 - south) / resolution))
+        for row in range(max(first, 0), min(last, rows - 1) + 1):
+            # The part of the edge within this row of cells
+            bottom = max(lat1, south + row * resolution)
+            top = min(lat2, south + (row + 1) * resolution)
+            if lat2 == lat1:
+                lons = (lon1, lon2)
+            else:
+                lons = [lon1 + (y - lat1) * (lon2 - lon1) / (lat2 - lat1) for y in (bottom, top)]
+            low = max(0, int(floor((min(lons) - west) / resolution)))
+            high = min(cols - 1, int(floor((max(lons) - west) / resolution)))
+            cells[row * cols + low:row * cols + high + 1] = bytes([BOUNDARY]) * (high - low + 1)
+
+def grid_path(resolution=DEFAULT_RESOLUTION):
+    """Return the path of the cached grid at resolution."""
+    return '{0}state_grid_{1:g}.bin'.format(DATA_PATH, resolution)
+
+_grids = {}
+
+def load_grid(resolution=DEFAULT_RESOLUTION):
+    """Return the StateGrid at resolution, memory-mapping a cached grid file
+    (see data.load_mapped_file) and building it first if it is missing or
+    out of date."""
+    if resolution not in _grids:
+        header, cells = load_mapped_file(grid_path(resolution), DATA_PATH + 'states.json',
+                                         lambda: build_grid(resolution))
+        _grids[resolution] = StateGrid(header, cells)
+    return _grids[resolution]
@@ -0,0 +1,160 @@
+"""The svg module implements a Canvas that writes Scalable Vector Graphics.
+
+Each distinct polygon outline is emitted once inside <defs> and drawn with a
+<use> element that carries only its colors, so redrawing the same states in
+new colors reuses the formatted geometry.  Only outlines still on the canvas
+are defined, and clearing shapes forgets the outlines that they used.  Circles are streamed to a temporary
+file as they are drawn, which keeps memory flat for very many tweet dots.
+"""
+
+import shutil
+import tempfile
+from html import escape
+from headless import HeadlessCanvas
+
+class SvgCanvas(HeadlessCanvas):
+    """A Canvas that records shapes and saves them as an SVG document.
+
+    draw_* methods return an id number for each shape, like graphics.Canvas.
+    Circles are always drawn above polygons and text, and clearing any tag
+    used by a circle removes them all.
+    """
+
+    def __init__(self, width=1024, height=768, title='', color='White'):
+        HeadlessCanvas.__init__(self, width, height, title, color)
+        self._symbols = {}  # polygon points -> symbol id, in order of first use
+        self._paths = {}    # symbol id -> formatted path data, once saved
+        self._symbol_count = 0
+        self._items = {}    # id -> [element, tag, symbol, fill, stroke, width]
+        self._dots = tempfile.TemporaryFile(mode='w+', encoding='utf8')
+        self._dot_tags = set()
+
+    def clear(self, shape='all'):
+        """Clear all shapes and text, or only those with the tag shape, and
+        forget the polygon outlines that no remaining shape uses."""
+        if shape == 'all':
+            self._items = {}
+        else:
+            self._items = {id: item for id, item in self._items.items() if item[1] != shape}
+        used = self._used_symbols()
+        self._symbols = {key: symbol for key, symbol in self._symbols.items() if symbol in used}
+        self._paths = {symbol: data for symbol, data in self._paths.items() if symbol in used}
+        if shape == 'all' or shape in self._dot_tags:
+            self._dots.seek(0)
+            self._dots.truncate()
+            self._dot_tags = set()
+
+    def draw_polygon(self, points, color='Black', fill_color=None, filled=1, smooth=0, width=1, tag=None):
+        """Draw a polygon and return its id.
+
+        points -- a list of (x, y) pairs encoding pixel positions
+        tag -- an optional name that clear(tag) uses to remove the shape
+        """
+        if fill_color == None:
+            fill_color = color
+        if filled == 0:
+            fill_color = 'none'
+        key = tuple(points)
+        if key not in self._symbols:
+            self._symbols[key] = 's{0}'.format(self._symbol_count)
+            self._symbol_count += 1
+        id = self._new_id()
+        self._items[id] = ['use', tag, self._symbols[key], fill_color, color, width]
+        return id
+
+    def draw_circle(self, center, radius, color='Black', fill_color=None, filled=1, width=1, tag=None):
+        """Draw a circle and return its id.
+
+        center -- an (x, y) pair encoding a pixel position
+        """
+        if fill_color == None:
+            fill_color = color
+        if filled == 0:
+            fill_color = 'none'
+        x, y = center
+        self._dot_tags.add(tag)
+        self._dots.write('<circle cx="{0:.1f}" cy="{1:.1f}" r="{2}" fill="{3}" stroke="{4}" stroke-width="{5}"/>\n'.format(
+            x, y, radius, fill_color, color, width))
+        return self._new_id()
+
+    def draw_text(self, text, pos, color='Black', font='Arial',
+                  size=12, style='normal', anchor='nw'):
+        """Draw text and return its id."""
+        x, y = pos
+        id = self._new_id()
+        self._items[id] = ['text', None, x, y, color, font, size, style, anchor, text]
+        return id
+
+    def edit_text(self, id, text=None, color=None, font=None, size=12,
+                  style='normal'):
+        """Edit the text, color, or font of an existing text object."""
+        item = self._items[id]
+        if color is not None:
+            item[4] = color
+        if text is not None:
+            item[9] = text
+        if font is not None:
+            item[5:8] = [font, size, style]
+
+    def edit_shape(self, id, color=None, fill_color=None):
+        """Change the outline or fill color of an existing polygon."""
+        item = self._items[id]
+        if color is not None:
+            item[4] = color
+        if fill_color is not None:
+            item[3] = fill_color
+
+    def edit_shapes(self, edits):
+        """Recolor many polygons; edits is a sequence of (id, fill_color) pairs."""
+        for id, fill_color in edits:
+            self._items[id][3] = fill_color
+
+    def save(self, path):
+        """Write everything drawn so far to path as an SVG document."""
+        with open(path, mode='w', encoding='utf8') as out:
+            out.write('<svg xmlns="http://www.w3.org/2000/svg" width="{0}" height="{1}">\n'.format(
+                self.width, self.height))
+            if self.title:
+                out.write('<title>{0}</title>\n'.format(escape(self.title)))
+            out.write('<rect width="100%" height="100%" fill="{0}"/>\n<defs>\n'.format(self.color))
+            used = self._used_symbols()
+            for points, symbol in self._symbols.items():
+                if symbol in used:
+                    if symbol not in self._paths:
+                        self._paths[symbol] = path_data(points)
+                    out.write('<path id="{0}" d="{1}"/>\n'.format(symbol, self._paths[symbol]))
+            out.write('</defs>\n')
+            for item in self._items.values():
+                if item[0] == 'use':
+                    out.write('<use href="#{2}" fill="{3}" stroke="{4}" stroke-width="{5}"/>\n'.format(*item))
+                else:
+                    out.write(text_element(*item[2:]) + '\n')
+            self._dots.seek(0)
+            shutil.copyfileobj(self._dots, out, 1 << 20)
+            out.write('</svg>\n')
+
+    def _used_symbols(self):
+        return {item[2] for item in self._items.values() if item[0] == 'use'}
+
+def text_element(x, y, color, font, size, style, anchor, text):
+    """Return an SVG text element positioned like Tk text with the given anchor.
+
+    >>> text_element(10, 20, 'Black', 'Arial', 12, 'bold', 'center', 'CA')
+    '<text x="10.0" y="20.0" fill="Black" font-family="Arial" font-size="12" font-weight="bold" text-anchor="middle" dominant-baseline="middle">CA</text>'
+    """
+    if anchor == 'center':
+        anchor = ''
+    horizontal = 'end' if 'e' in anchor else 'start' if 'w' in anchor else 'middle'
+    vertical = 'hanging' if 'n' in anchor else 'auto' if 's' in anchor else 'middle'
+    weight = 'bold' if style == 'bold' else 'normal'
+    return ('<text x="{0:.1f}" y="{1:.1f}" fill="{2}" font-family="{3}" font-size="{4}" '
+            'font-weight="{5}" text-anchor="{6}" dominant-baseline="{7}">{8}</text>').format(
+            x, y, color, font, size, weight, horizontal, vertical, escape(text))
+
+def path_data(points):
+    """Return SVG path data for a closed polygon.
+
+    >>> path_data(((0, 0), (4, 0), (4, 2.5)))
+    'M0.0 0.0L4.0 0.0L4.0 2.5Z'
+    """
+    return 'M' + 'L'.join('{0:.1f} {1:.1f}'.format(x, y) for x, y in points) + 'Z'
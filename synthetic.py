@@ -0,0 +1,129 @@
+"""Generate synthetic tweets files of any size for testing and benchmarks.
+
+Generated files use the same format as the bundled tweets files, so
+load_tweets and generate_filtered_file read them like real corpora:
+
+  [lat, lon]<tab>6<tab>YYYY-MM-DD HH:MM:SS<tab>text
+
+Locations are drawn near the locations of bundled tweets, so that their
+density follows where people actually tweet, and are kept only if they fall
+inside a state in states.json.  Tweet text mixes words from the sentiment
+lexicon with noise words.  The same seed always produces the same file.
+
+Usage:
+  python3 synthetic.py data/synthetic_tweets.txt --tweets 1000000 --seed 0
+"""
+
+import random
+from itertools import accumulate
+from datetime import datetime, timedelta
+from data import word_sentiments, split_tweet_line, bundled_tweets_paths
+from geo import us_states, make_position, point_in_polygon
+from ucb import main
+
+LOCATION_POOL_SIZE = 1 << 15
+JITTER_DEGREES = 0.25
+WORD_DECK_SIZE = 1 << 20
+LINES_PER_WRITE = 10000
+
+def state_bounds():
+    """Return a list of (south, west, north, east, polygon) bounds for every
+    polygon of every state."""
+    bounds = []
+    for shapes in us_states.values():
+        for polygon in shapes:
+            lats = [lat for lat, _ in polygon]
+            lons = [lon for _, lon in polygon]
+            bounds.append((min(lats), min(lons), max(lats), max(lons), polygon))
+    return bounds
+
+def in_a_state(position, bounds):
+    """Return whether position lies inside one of the polygons in bounds."""
+    lat, lon = position
+    return any(south <= lat <= north and west <= lon <= east and
+               point_in_polygon(position, polygon)
+               for south, west, north, east, polygon in bounds)
+
+def anchor_locations():
+    """Return the locations of all bundled tweets."""
+    anchors = []
+    for path in bundled_tweets_paths():
+        with open(path, encoding='utf8') as tweets:
+            for line in tweets:
+                fields = split_tweet_line(line)
+                if fields:
+                    anchors.append(make_position(fields[0], fields[1]))
+    return anchors
+
+def location_pool(rng, size=LOCATION_POOL_SIZE):
+    """Return a list of size location strings inside U.S. states, each near
+    the location of a bundled tweet, or anywhere in a state if there are none."""
+    bounds = state_bounds()
+    anchors = anchor_locations()
+    pool = []
+    while len(pool) < size:
+        if anchors:
+            lat, lon = rng.choice(anchors)
+            lat, lon = rng.gauss(lat, JITTER_DEGREES), rng.gauss(lon, JITTER_DEGREES)
+        else:
+            south, west, north, east, _ = rng.choice(bounds)
+            lat, lon = rng.uniform(south, north), rng.uniform(west, east)
+        if in_a_state((lat, lon), bounds):
+            pool.append('[{0:.6f}, {1:.6f}]'.format(lat, lon))
+    return pool
+
+def noise_words(rng, count=2000):
+    """Return a list of count random lowercase words that may be misspelled
+    or made up, as tweets often are."""
+    letters = 'etaoinshrdlcumwfgypbvkjxqz'
+    weights = [26 - i for i in range(26)]
+    return [''.join(rng.choices(letters, weights, k=rng.randint(2, 9))) for _ in range(count)]
+
+def generate_corpus(path, tweets, seed=0, start=datetime(2011, 8, 28),
+                    end=datetime(2011, 9, 20), sentiment_fraction=0.3,
+                    words_per_tweet=(3, 20)):
+    """Write a tweets file of the given number of tweets to path.
+
+    Times are spread uniformly from start to end, and each word of a tweet is
+    a lexicon word with probability sentiment_fraction and a noise word
+    otherwise.  Tweets have between the two numbers of words_per_tweet words.
+    """
+    rng = random.Random(seed)
+    locations = location_pool(rng)
+    lexicon = sorted(word_sentiments)
+    noise = noise_words(rng)
+    # Each tweet is a run of consecutive words from a long random deck,
+    # which is much faster than choosing its words one at a time
+    weights = ([sentiment_fraction / len(lexicon)] * len(lexicon) +
+               [(1 - sentiment_fraction) / len(noise)] * len(noise))
+    deck = rng.choices(lexicon + noise, cum_weights=list(accumulate(weights)), k=WORD_DECK_SIZE)
+    low, high = words_per_tweet
+    seconds = int((end - start).total_seconds())
+    choice, randrange, randint = rng.choice, rng.randrange, rng.randint
+    with open(path, mode='w', encoding='utf8') as out:
+        written = 0
+        while written < tweets:
+            lines = []
+            for _ in range(min(LINES_PER_WRITE, tweets - written)):
+                first = randrange(WORD_DECK_SIZE - high)
+                words = deck[first:first + randint(low, high)]
+                time = start + timedelta(seconds=randrange(seconds))
+                lines.append('{0}\t6\t{1}\t{2}\n'.format(choice(locations), time, ' '.join(words)))
+            out.writelines(lines)
+            written += len(lines)
+
+@main
+def run(*args):
+    """Write a synthetic tweets file with the options given on the command line."""
+    import argparse
+    parser = argparse.ArgumentParser(description="Generate a synthetic tweets file")
+    parser.add_argument('path', type=str)
+    parser.add_argument('--tweets', '-n', type=int, default=100000)
+    parser.add_argument('--seed', '-s', type=int, default=0)
+    parser.add_argument('--start', type=str, default='2011-08-28',
+                        help='Earliest tweet date, YYYY-MM-DD')
+    parser.add_argument('--end', type=str, default='2011-09-20',
+                        help='Latest tweet date, YYYY-MM-DD')
+    args = parser.parse_args()
+    start, end = (datetime.strptime(d, '%Y-%m-%d') for d in (args.start, args.end))
+    generate_corpus(args.path, args.tweets, args.seed, start, end)
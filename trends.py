@@ -1,9 +1,22 @@
 """Visualizing Twitter Sentiment Across America"""
 
-from data import word_sentiments, load_tweets
-from datetime import datetime
-from geo import us_states, geo_distance, make_position, longitude, latitude
-from maps import draw_state, draw_name, draw_dot, wait
+import data
+import instrument
+import sys
+from cache import result_key, load_result, save_result
+from data import load_tweets, iter_tweets
+from datetime import datetime, timedelta
+from query import is_query, split_terms, load_matching_tweets, iter_matching_tweets
+from progress import terminal_progress
+from itertools import islice
+from sketches import QuantileSketch, TopKSketch
+from wordmatrix import WordStateMatrix
+from lexicon import load_lexicon
+from phrases import PhraseAutomaton
+from stategrid import load_grid
+from regions import RegionSet, load_regions
+from geo import us_states, geo_distance_many, make_position, longitude, latitude
+from maps import draw_state, draw_state_layer, animate_state_layer, clear_dots, draw_name, draw_dot, draw_dots, draw_binned_dots, wait, set_backend, save
 from string import ascii_letters
 from ucb import main, trace, interact, log_current_line
 
@@ -127,6 +140,22 @@ def sentiment_value(s): #version of has sentiment that returns the value rather
     assert has_sentiment(s), 'No sentiment value'
     return s
 
+_lexicon = []
+
+def sentiment_lexicon():
+    """Return the mapping from words to sentiment scores: data.word_sentiments,
+    which is loaded when first used, or else the CompactLexicon chosen by
+    use_compact_lexicon."""
+    if not _lexicon:
+        _lexicon.append(data.word_sentiments)
+    return _lexicon[0]
+
+def use_compact_lexicon():
+    """Look up word sentiments in the memory-mapped CompactLexicon (see
+    lexicon.py), shared by every process, instead of a dictionary.  Call it
+    before any sentiments are looked up, or the dictionary is loaded anyway."""
+    _lexicon[:] = [load_lexicon()]
+
 def get_word_sentiment(word):
     """Return a sentiment representing the degree of positive or negative
     feeling in the given word.
@@ -141,7 +170,7 @@ def get_word_sentiment(word):
     False
     """
     # Learn more: http://docs.python.org/3/library/stdtypes.html#dict.get
-    return make_sentiment(word_sentiments.get(word))
+    return make_sentiment(sentiment_lexicon().get(word))
 
 def analyze_tweet_sentiment(tweet):
     """ Return a sentiment representing the degree of positive or negative
@@ -173,6 +202,36 @@ def analyze_tweet_sentiment(tweet):
     length = len(sent_list)
     return make_sentiment(total / length) #returns sentiment for entire tweet by averaging the values in the list (or the sentiments of the words in the tweet that had sentiments)
 
+_phrase_automaton = []
+
+def phrase_automaton():
+    """Return a PhraseAutomaton of the sentiment lexicon, compiled once.
+
+    The automaton is built in the memory of each process, so phrase scoring
+    does not share memory between processes even with a compact lexicon.
+    """
+    if not _phrase_automaton:
+        _phrase_automaton.append(PhraseAutomaton(sentiment_lexicon()))
+    return _phrase_automaton[0]
+
+def analyze_tweet_phrases(tweet):
+    """Return a sentiment for a tweet like analyze_tweet_sentiment, but
+    matching multi-word lexicon entries and negating the entries that follow
+    negation words (see phrases.py).
+
+    >>> sentiment_value(analyze_tweet_phrases(make_tweet("not good", None, 0, 0)))
+    -0.4375
+    >>> sentiment_value(analyze_tweet_phrases(make_tweet("not bad, no matter what", None, 0, 0)))
+    0.1875
+    >>> has_sentiment(analyze_tweet_phrases(make_tweet("berkeley golden bears!", None, 0, 0)))
+    False
+    """
+    return make_sentiment(phrase_automaton().score(tweet_text(tweet)))
+
+# The names of the scoring functions for each scoring mode, looked up when a
+# query runs so that traced functions are the ones called
+SCORERS = {'words': 'analyze_tweet_sentiment', 'phrases': 'analyze_tweet_phrases'}
+
 
 #################################
 # Phase 2: The Geometry of Maps #
@@ -256,17 +315,52 @@ def find_state_center(polygons):
     X_overall, Y_overall = X_overall / Area_overall, Y_overall/Area_overall
     return make_position(X_overall, Y_overall)  #The final values of the X and Y coordinates.
 
+_state_centers = {}
+
+def state_centers():
+    """Return a dictionary from state names to state centers, which are
+    computed only the first time this function is called.
+
+    >>> state_centers()['CA'] == find_state_center(us_states['CA'])
+    True
+    """
+    if not _state_centers:
+        _state_centers.update((name, find_state_center(shapes))
+                              for name, shapes in us_states.items())
+    return _state_centers
+
+MAX_LABELED_REGIONS = 100
+_us_regions = []
+
+def us_regions():
+    """Return the U.S. states as a RegionSet, with the centers computed by
+    state_centers and the precomputed state grid for finding which state
+    contains a position."""
+    if not _us_regions:
+        _us_regions.append(RegionSet(us_states, state_centers(), lookup=_grid_state_at))
+    return _us_regions[0]
+
+def _grid_state_at(position):
+    return load_grid().state_at(latitude(position), longitude(position))
+
 ###################################
 # Phase 3: The Mood of the Nation #
 ###################################
 
-def group_tweets_by_state(tweets):
+def group_tweets_by_state(tweets, mode='center', regions=None):
     """Return a dictionary that aggregates tweets by their nearest state center.
 
     The keys of the returned dictionary are state names, and the values are
     lists of tweets that appear closer to that state center than any other.
 
     tweets -- a sequence of tweet abstract data types
+    mode -- 'center' to group tweets by nearest state center, or 'grid' to
+            group them by the state that contains them, as looked up in a
+            precomputed grid (see stategrid.py); tweets outside every state
+            are still grouped by nearest state center
+    regions -- a RegionSet (see regions.py) to group tweets into instead of
+               the U.S. states; in 'grid' mode, tweets are grouped by the
+               region that contains them using the region set's index
 
     >>> sf = make_tweet("welcome to san francisco", None, 38, -122)
     >>> ny = make_tweet("welcome to new york", None, 41, -74)
@@ -278,23 +372,25 @@ def group_tweets_by_state(tweets):
     1
     >>> tweet_string(california_tweets[0])
     '"welcome to san francisco" @ (38, -122)'
+
+    Near borders, the state that contains a tweet may not have the nearest center.
+
+    >>> detroit = make_tweet("welcome to detroit", None, 42.33, -83.05)
+    >>> list(group_tweets_by_state([detroit])), list(group_tweets_by_state([detroit], 'grid'))
+    (['OH'], ['MI'])
     """
     tweets_by_state = {}
-    states_centers = {state: find_state_center(us_states[state]) for state in us_states.keys()} # creates the dictionary state_centers that contains each state it's its respective state center   
-    for tweet in tweets: # goes through every tweet and assigns it to the dictionary tweets_by_state by its closest state center
-      closest, state_name = 0, '' 
-      for state in states_centers:
-        distance = geo_distance(tweet_location(tweet), states_centers[state]) # adds the distance from tweet to each state center to the list called distances 
-        if closest == 0 or distance < closest:
-          closest = distance  # if current state is closer than previous closest state, reassigns closest and state_name accordingly
-          state_name = state
+    regions = regions or us_regions() # the states (or other regions) with their centers and spatial index
+    locations = [tweet_location(tweet) for tweet in tweets]
+    state_names = regions.assign(locations, 'contain' if mode == 'grid' else 'center') # the state of each tweet, computed together
+    for tweet, state_name in zip(tweets, state_names): # assigns every tweet to the dictionary tweets_by_state by its state
       if state_name in tweets_by_state:   # if this state is already defined in the dictionary then the tweets is added to the existing state key
         tweets_by_state[state_name].append(tweet) 
       else: # if this state does not already contain a position in the directoy, then one is created
         tweets_by_state[state_name] = [tweet]
     return tweets_by_state   # Returns the dictionary that has aggregated tweets by their nearest state center
 
-def average_sentiments(tweets_by_state):
+def average_sentiments(tweets_by_state, score=None):
     """Calculate the average sentiment of the states by averaging over all
     the tweets from each state. Return the result as a dictionary from state
     names to average sentiment values (numbers).
@@ -305,21 +401,119 @@ def average_sentiments(tweets_by_state):
     sentiment.
 
     tweets_by_state -- A dictionary from state names to lists of tweets
+    score -- the function that scores each tweet; analyze_tweet_sentiment by default
     """
+    score = score or analyze_tweet_sentiment
     averaged_state_sentiments = {}
     for key in tweets_by_state.keys():
         tweets_per_state = tweets_by_state[key] #makes tweets_per_state a list of tweets per that state, and does this (and the code below) for each state
         total_tweets = 0 #counter for number of tweets that have a sentiment
         for x in range(len(tweets_per_state)): 
-            if has_sentiment(analyze_tweet_sentiment(tweets_per_state[x])) == False: #if tweet doesnt have a sentiment replace it will a sentiment value of 0
+            if has_sentiment(score(tweets_per_state[x])) == False: #if tweet doesnt have a sentiment replace it will a sentiment value of 0
                 tweets_per_state[x] = 0
             else:
                 total_tweets += 1 
-                tweets_per_state[x] = sentiment_value(analyze_tweet_sentiment(tweets_per_state[x])) #if this tweet has a sentiment, replace it with the sentiment value
+                tweets_per_state[x] = sentiment_value(score(tweets_per_state[x])) #if this tweet has a sentiment, replace it with the sentiment value
         if total_tweets != 0: #if no tweets in this state have senitments then skip this step, go to next state
             averaged_state_sentiments[key] = sum(tweets_per_state) / (total_tweets) #returns average sentiment of all tweets per this state that have sentiments
     return averaged_state_sentiments
 
+def state_sentiments_by_period(tweets, hours=24, regions=None):
+    """Return a list of (start time, state sentiments) pairs, one for each
+    consecutive period of the given number of hours, starting at the time of
+    the earliest tweet.  State sentiments are averaged as in average_sentiments,
+    over the regions of a RegionSet if regions is given.
+
+    >>> sf1 = make_tweet("i love san francisco", datetime(2011, 9, 1, 8), 38, -122)
+    >>> sf2 = make_tweet("i hate san francisco", datetime(2011, 9, 2, 20), 38, -122)
+    >>> for start, sentiments in state_sentiments_by_period([sf1, sf2], 24):
+    ...     print(start, sentiments)
+    2011-09-01 08:00:00 {'CA': 0.1875}
+    2011-09-02 08:00:00 {'CA': -0.25}
+    """
+    if not tweets:
+        return []
+    start = min(tweet_time(tweet) for tweet in tweets)
+    period = timedelta(hours=hours)
+    totals = {}  # (period index, state name) -> [sentiment total, tweet count]
+    for name, state_tweets in group_tweets_by_state(tweets, regions=regions).items():
+        for tweet in state_tweets:
+            s = analyze_tweet_sentiment(tweet)
+            if has_sentiment(s):
+                key = ((tweet_time(tweet) - start) // period, name)
+                total = totals.setdefault(key, [0, 0])
+                total[0] += sentiment_value(s)
+                total[1] += 1
+    count = (max(tweet_time(tweet) for tweet in tweets) - start) // period + 1
+    frames = [(start + index * period, {}) for index in range(count)]
+    for (index, name), (total, n) in totals.items():
+        frames[index][1][name] = total / n
+    return frames
+
+def sketch_state_sentiments(tweets, k=200, capacity=100, batch_size=10000, regions=None):
+    """Return a dictionary from state names (or the names of regions, a
+    RegionSet) to (quantiles, top words) pairs.
+
+    The quantiles are a QuantileSketch of the sentiments of the state's
+    tweets, and the top words are a TopKSketch of the words with sentiments
+    in them.  tweets may be any iterable, such as iter_tweets(...); it is
+    consumed batch_size tweets at a time, so memory does not grow with the
+    number of tweets.  Dictionaries from separate workers can be combined
+    with sketches.merge_sketches.
+
+    >>> sf1 = make_tweet("love san francisco", None, 38, -122)
+    >>> sf2 = make_tweet("hate hate san francisco", None, 38, -122)
+    >>> quantiles, words = sketch_state_sentiments([sf1, sf2])['CA']
+    >>> quantiles.count, words.top(2)
+    (2, [('hate', 2), ('love', 1)])
+    """
+    sketches = {}
+    tweets = iter(tweets)
+    batch = list(islice(tweets, batch_size))
+    while batch:
+        for name, state_tweets in group_tweets_by_state(batch, regions=regions).items():
+            if name not in sketches:
+                sketches[name] = (QuantileSketch(k), TopKSketch(capacity))
+            quantiles, words = sketches[name]
+            for tweet in state_tweets:
+                s = analyze_tweet_sentiment(tweet)
+                if has_sentiment(s):
+                    quantiles.update(sentiment_value(s))
+                    for word in tweet_words(tweet):
+                        if has_sentiment(get_word_sentiment(word)):
+                            words.update(word)
+        batch = list(islice(tweets, batch_size))
+    return sketches
+
+def word_state_matrix(tweets, batch_size=10000, regions=None):
+    """Return a WordStateMatrix of the count and total sentiment weight of
+    each sentiment word in the tweets of each state (or region).
+
+    Like sketch_state_sentiments, it consumes tweets, which may be any
+    iterable, batch_size tweets at a time in a single pass.
+
+    >>> sf1 = make_tweet("love san francisco", None, 38, -122)
+    >>> sf2 = make_tweet("hate hate san francisco", None, 38, -122)
+    >>> word_state_matrix([sf1, sf2]).top('CA')
+    [('love', 1, 0.625), ('hate', 2, -0.5)]
+    """
+    rows, tweet_counts = {}, {}
+    tweets = iter(tweets)
+    batch = list(islice(tweets, batch_size))
+    while batch:
+        for name, state_tweets in group_tweets_by_state(batch, regions=regions).items():
+            row = rows.setdefault(name, {})
+            tweet_counts[name] = tweet_counts.get(name, 0) + len(state_tweets)
+            for tweet in state_tweets:
+                for word in tweet_words(tweet):
+                    s = get_word_sentiment(word)
+                    if has_sentiment(s):
+                        totals = row.setdefault(word, [0, 0.0])
+                        totals[0] += 1
+                        totals[1] += sentiment_value(s)
+        batch = list(islice(tweets, batch_size))
+    return WordStateMatrix.from_rows(rows, tweet_counts)
+
 ##########################
 # Command Line Interface #
 ##########################
@@ -333,46 +527,167 @@ def print_sentiment(text='Are you virtuous or verminous?'):
         if has_sentiment(s):
             print(layout.format(word, sentiment_value(s)))
 
+def print_sentiment_quantiles(term='my job', file_name='tweets2011.txt', regions=None):
+    """Print sentiment quartiles and top sentiment words for each state (or
+    region), summarizing the tweets that contain term in a single streaming pass."""
+    if is_query(term):
+        tweets = iter_matching_tweets(make_tweet, term, file_name, terminal_progress())
+    else:
+        tweets = iter_tweets(make_tweet, term, file_name, progress=terminal_progress())
+    sketches = sketch_state_sentiments(tweets, regions=regions)
+    for name, (quantiles, words) in sorted(sketches.items()):
+        if quantiles.count:
+            low, median, high = quantiles.quantiles([0.25, 0.5, 0.75])
+            top = ', '.join(word for word, _ in words.top(5))
+            print('{0}: {1:6} tweets  {2:+.3f} {3:+.3f} {4:+.3f}  {5}'.format(
+                name, quantiles.count, low, median, high, top))
+
+def print_state_words(term='my job', file_name='tweets2011.txt', k=5, regions=None):
+    """Print the k sentiment words that contribute the most weight, positive
+    or negative, to the mood of each state (or region) in the tweets that
+    contain term."""
+    if is_query(term):
+        tweets = iter_matching_tweets(make_tweet, term, file_name, terminal_progress())
+    else:
+        tweets = iter_tweets(make_tweet, term, file_name, progress=terminal_progress())
+    matrix = word_state_matrix(tweets, regions=regions)
+    for name in matrix.names:
+        top = ', '.join('{0} {1:+.2f}'.format(word, weight) for word, _, weight in matrix.top(name, k))
+        print('{0}: {1}'.format(name, top))
+
 def draw_centered_map(center_state='TX', n=10):
     """Draw the n states closest to center_state."""
-    us_centers = {n: find_state_center(s) for n, s in us_states.items()}
+    us_centers = state_centers()
     center = us_centers[center_state.upper()]
-    dist_from_center = lambda name: geo_distance(center, us_centers[name])
-    for name in sorted(us_states.keys(), key=dist_from_center)[:int(n)]:
+    names = list(us_states.keys())
+    distances = dict(zip(names, geo_distance_many(center, [us_centers[name] for name in names])))
+    for name in sorted(names, key=distances.get)[:int(n)]:
         draw_state(us_states[name])
         draw_name(name, us_centers[name])
     draw_dot(center, 1, 10)  # Mark the center state with a red dot
     wait()
 
-def draw_state_sentiments(state_sentiments):
+def draw_state_sentiments(state_sentiments, regions=None):
     """Draw all U.S. states in colors corresponding to their sentiment value.
 
     Unknown state names are ignored; states without values are colored grey.
+    States drawn by an earlier call are recolored rather than redrawn.
 
     state_sentiments -- A dictionary from state strings to sentiment values
+    regions -- a RegionSet to draw instead of the U.S. states; regions are
+               only labeled if there are at most MAX_LABELED_REGIONS of them
     """
-    for name, shapes in us_states.items():
-        sentiment = state_sentiments.get(name, None)
-        draw_state(shapes, sentiment)
-    for name, shapes in us_states.items():
-        center = find_state_center(shapes)
+    regions = regions or us_regions()
+    new = draw_state_layer({name: (shapes, state_sentiments.get(name, None))
+                            for name, shapes in regions.shapes.items()})
+    for name in new if len(regions) <= MAX_LABELED_REGIONS else ():
+        center = regions.centers[name]
         if center is not None:
             draw_name(name, center)
 
-def draw_map_for_query(term='my job', file_name='tweets2011.txt'):
+def analyze_query(term='my job', file_name='tweets2011.txt', use_cache=True, progress=None,
+                  assign='center', regions=None, scoring='words'):
+    """Return a dictionary describing the sentiment of tweets that contain term.
+
+    The dictionary has these keys:
+      tweets -- the number of tweets that contain term
+      state_sentiments -- a dictionary from state names to average sentiments
+      dots -- a list of [latitude, longitude, sentiment] lists, one for each
+              tweet that has a sentiment
+
+    term may also be a query such as 'texas AND (love OR hate)'; see query.py.
+
+    Results are cached on disk, keyed on term, the tweets file, and the
+    sentiment lexicon, so repeating a query skips loading and scoring tweets.
+    Loading tweets reports its progress to progress, an optional callback
+    (see progress.py).  Tweets are assigned to states, or to the regions of a
+    RegionSet, as group_tweets_by_state does in the given assign mode.
+    Tweets are scored by the function named SCORERS[scoring]: single words,
+    or phrases with negation.
+    """
+    key = query_key(term, file_name, assign, regions, scoring)
+    score = globals()[SCORERS[scoring]]
+    result = load_result(key) if use_cache else None
+    if result is not None:
+        instrument.count('cached results')
+    else:
+        with instrument.stage('load tweets'):
+            if is_query(term):
+                tweets = load_matching_tweets(make_tweet, term, file_name, progress)
+            else:
+                tweets = load_tweets(make_tweet, term, file_name, progress=progress)
+        dots = []
+        with instrument.stage('score tweets'):
+            for tweet in tweets:
+                s = score(tweet)
+                if has_sentiment(s):
+                    location = tweet_location(tweet)
+                    dots.append([latitude(location), longitude(location), sentiment_value(s)])
+        instrument.count('tweets scored', len(dots))
+        instrument.count('tweets unscored', len(tweets) - len(dots))
+        with instrument.stage('group tweets by state'):
+            tweets_by_state = group_tweets_by_state(tweets, assign, regions)
+        with instrument.stage('average sentiments'):
+            state_sentiments = average_sentiments(tweets_by_state, score)
+        result = {'tweets': len(tweets), 'state_sentiments': state_sentiments, 'dots': dots}
+        if use_cache:
+            save_result(key, result)
+    return result
+
+def query_key(term, file_name, assign='center', regions=None, scoring='words'):
+    """Return the cache key of the result of analyze_query for these arguments."""
+    key = result_key(term, file_name)
+    if assign != 'center':
+        key.append(assign)
+    if regions is not None:
+        key.append(regions.key)
+    if scoring != 'words':
+        key.append(scoring)
+    return key
+
+def draw_map_for_query(term='my job', file_name='tweets2011.txt', bin_size=0, assign='center',
+                       regions=None, scoring='words'):
     """Draw the sentiment map corresponding to the tweets that contain term.
 
+    If bin_size is positive, tweets are aggregated into hexagonal bins of that
+    radius (in pixels) instead of being drawn as one dot each.
+    Tweets are assigned to states as by group_tweets_by_state in mode assign,
+    or to the regions of a RegionSet if regions is given, and scored as
+    analyze_query does for the scoring mode.
+
     Some term suggestions:
     New York, Texas, sandwich, my life, justinbieber
     """
-    tweets = load_tweets(make_tweet, term, file_name)
-    tweets_by_state = group_tweets_by_state(tweets)
-    state_sentiments = average_sentiments(tweets_by_state)
-    draw_state_sentiments(state_sentiments)
-    for tweet in tweets:
-        s = analyze_tweet_sentiment(tweet)
-        if has_sentiment(s):
-            draw_dot(tweet_location(tweet), sentiment_value(s))
+    result = analyze_query(term, file_name, progress=terminal_progress(), assign=assign,
+                           regions=regions, scoring=scoring)
+    with instrument.stage('draw map'):
+        draw_state_sentiments(result['state_sentiments'], regions)
+        clear_dots()
+        locations = [make_position(lat, lon) for lat, lon, _ in result['dots']]
+        values = [value for _, _, value in result['dots']]
+        if bin_size > 0:
+            draw_binned_dots(locations, values, bin_size)
+        else:
+            draw_dots(locations, values)
+    wait()
+
+def draw_timelapse_for_query(term='my job', file_name='tweets2011.txt', hours=24, regions=None):
+    """Animate the sentiment map for term, one frame per period of hours,
+    coloring the regions of a RegionSet instead of states if regions is given.
+
+    State sentiments for every period are computed before the animation
+    starts, so each frame only recolors states.  term may be a query, as for
+    analyze_query.
+    """
+    if is_query(term):
+        tweets = load_matching_tweets(make_tweet, term, file_name, terminal_progress())
+    else:
+        tweets = load_tweets(make_tweet, term, file_name, progress=terminal_progress())
+    periods = state_sentiments_by_period(tweets, hours, regions)
+    draw_state_sentiments({}, regions)
+    labels = [start.strftime('%Y-%m-%d %H:%M') for start, _ in periods]
+    animate_state_layer([sentiments for _, sentiments in periods],
+                        (regions or us_regions()).shapes, labels)
     wait()
 
 def swap_tweet_representation(other=[make_tweet_fn, tweet_text_fn,
@@ -391,20 +706,74 @@ def run(*args):
     parser = argparse.ArgumentParser(description="Run Trends")
     parser.add_argument('--print_sentiment', '-p', action='store_true')
     parser.add_argument('--draw_centered_map', '-d', action='store_true')
-    parser.add_argument('--draw_map_for_query', '-m', type=str)
+    parser.add_argument('--draw_map_for_query', '-m', type=str,
+                        help='Query term; separate terms with commas to switch between them by clicking')
     parser.add_argument('--tweets_file', '-t', type=str, default='tweets2011.txt')
+    parser.add_argument('--quantiles', '-q', action='store_true',
+                        help='Print sentiment quartiles and top words per state for the query')
+    parser.add_argument('--words', '-w', type=int, default=0,
+                        help='Print this many sentiment words that drive each state for the query')
+    parser.add_argument('--compact_lexicon', '-L', action='store_true',
+                        help='Look up word sentiments in a shared memory-mapped lexicon '
+                             '(phrase scoring still builds its own automaton)')
     parser.add_argument('--use_functional_tweets', '-f', action='store_true')
+    parser.add_argument('--timelapse', '-l', type=float, default=0,
+                        help='Animate the query map, one frame per this many hours')
+    parser.add_argument('--bin_size', '-b', type=int, default=0,
+                        help='Draw tweets as hexagonal bins of this radius')
+    parser.add_argument('--assign', '-a', choices=('center', 'grid'), default='center',
+                        help='Assign tweets to the nearest state center, or to the '
+                             'state that contains them using a precomputed grid')
+    parser.add_argument('--scoring', '-S', choices=sorted(SCORERS), default='words',
+                        help='Score tweets by single words, or by phrases with negation')
+    parser.add_argument('--regions', '-r', type=str,
+                        help='Group tweets into the regions in this GeoJSON file instead of states')
+    parser.add_argument('--output', '-o', type=str,
+                        help='Save the map to a .png or .svg file instead of opening a window')
+    parser.add_argument('--serve', '-s', type=str, nargs='?', const='localhost:8061',
+                        help='Answer queries over HTTP at host:port or a Unix socket path')
+    parser.add_argument('--profile', '-P', type=str, nargs='?', const='-',
+                        help='Report stage times and tweet counts at exit, '
+                             'as a table or to the given JSON file')
+    parser.add_argument('--trace', '-T', type=str,
+                        help='Log a sample of calls to these comma-separated functions')
     parser.add_argument('text', metavar='T', type=str, nargs='*',
                         help='Text to process')
     args = parser.parse_args()
+    if args.profile or args.trace:
+        traced = [(sys.modules[__name__], name.strip()) for name in (args.trace or '').split(',') if name.strip()]
+        instrument.enable(args.profile or '-', traced)
+    if args.compact_lexicon:
+        use_compact_lexicon()
     if args.use_functional_tweets:
         swap_tweet_representation()
         print("Now using a functional representation of tweets!")
         args.use_functional_tweets = False
+    regions = load_regions(args.regions) if args.regions else None
+    if args.serve:
+        import server
+        # This module, not a fresh import of trends.py, has the options applied
+        server.serve(args.serve, trends=sys.modules[__name__], assign=args.assign,
+                     regions=regions, scoring=args.scoring)
+        return
+    if args.output:
+        set_backend(args.output.rsplit('.', 1)[-1].lower())
     if args.draw_map_for_query:
-        draw_map_for_query(args.draw_map_for_query, args.tweets_file)
+        terms = split_terms(args.draw_map_for_query)
+        for term in terms:
+            if args.quantiles:
+                print_sentiment_quantiles(term.strip(), args.tweets_file, regions)
+            elif args.words:
+                print_state_words(term.strip(), args.tweets_file, args.words, regions)
+            elif args.timelapse:
+                draw_timelapse_for_query(term.strip(), args.tweets_file, args.timelapse, regions)
+            else:
+                draw_map_for_query(term.strip(), args.tweets_file, args.bin_size, args.assign, regions,
+                                   args.scoring)
         print(args.tweets_file)
-        return
-    for name, execute in args.__dict__.items():
-        if name != 'text' and name != 'tweets_file' and execute:
-            globals()[name](' '.join(args.text))
+    else:
+        for name in ('print_sentiment', 'draw_centered_map'):
+            if getattr(args, name):
+                globals()[name](' '.join(args.text))
+    if args.output:
+        save(args.output)
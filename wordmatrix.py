@@ -0,0 +1,103 @@
+"""A sparse matrix of how much each sentiment word contributes to each state.
+
+Rows are states (or other regions) and columns are words.  Each entry holds
+the number of times the word appeared in the state's tweets and its total
+sentiment weight (its sentiment value times that number).  Most words never
+appear in most states, so the matrix is stored in compressed sparse row
+(CSR) form: for row r, the entries are at positions indptr[r] up to
+indptr[r + 1] of the columns, counts, and weights arrays, in column order.
+
+Only the per-row totals are kept while tweets stream by, so a matrix of a
+whole corpus takes memory proportional to the number of distinct (state,
+word) pairs, not the number of tweets.
+"""
+
+import heapq
+from array import array
+
+class WordStateMatrix(object):
+    """Word counts and sentiment weights for each state, as CSR arrays.
+
+    >>> rows = {'CA': {'love': [2, 1.5], 'hate': [1, -0.75]}, 'NY': {'hate': [3, -2.25]}}
+    >>> matrix = WordStateMatrix.from_rows(rows, {'CA': 2, 'NY': 3})
+    >>> list(matrix.indptr), matrix.words
+    ([0, 2, 3], ['hate', 'love'])
+    >>> matrix.top('CA')
+    [('love', 2, 1.5), ('hate', 1, -0.75)]
+    >>> matrix.diff('CA', 'NY')
+    [('love', 0.75), ('hate', 0.375)]
+    """
+
+    def __init__(self, names, words, indptr, columns, counts, weights, tweets):
+        """names -- row names; words -- column words, sorted
+        indptr, columns, counts, weights -- the CSR arrays
+        tweets -- the number of tweets in each row
+        """
+        self.names = names
+        self.words = words
+        self.indptr = indptr
+        self.columns = columns
+        self.counts = counts
+        self.weights = weights
+        self.tweets = tweets
+        self._rows = {name: r for r, name in enumerate(names)}
+
+    @classmethod
+    def from_rows(cls, rows, tweets):
+        """Return a matrix of rows, a dictionary from names to dictionaries
+        from words to [count, weight] totals, and tweets, a dictionary from
+        names to their numbers of tweets."""
+        names = sorted(set(rows) | set(tweets))
+        words = sorted(set(word for row in rows.values() for word in row))
+        column = {word: c for c, word in enumerate(words)}
+        indptr, columns = array('q', [0]), array('l')
+        counts, weights = array('q'), array('d')
+        for name in names:
+            for word in sorted(rows.get(name, ()), key=column.get):
+                count, weight = rows[name][word]
+                columns.append(column[word])
+                counts.append(count)
+                weights.append(weight)
+            indptr.append(len(columns))
+        return cls(names, words, indptr, columns, counts, weights,
+                   array('q', [tweets.get(name, 0) for name in names]))
+
+    def __contains__(self, name):
+        return name in self._rows
+
+    def row(self, name):
+        """Return a dictionary from each word in the named row to a (count,
+        weight) pair.  A name without a row has no words."""
+        if name not in self._rows:
+            return {}
+        r = self._rows[name]
+        start, end = self.indptr[r], self.indptr[r + 1]
+        return {self.words[c]: (n, w) for c, n, w in zip(self.columns[start:end],
+                                                        self.counts[start:end],
+                                                        self.weights[start:end])}
+
+    def top(self, name, k=10):
+        """Return the k words with the largest total weights, positive or
+        negative, in the named row, as (word, count, weight) triples."""
+        entries = ((word, n, w) for word, (n, w) in self.row(name).items())
+        return heapq.nlargest(k, entries, key=lambda entry: (abs(entry[2]), entry[0]))
+
+    def weight_per_tweet(self, name):
+        """Return a dictionary from each word in the named row to its total
+        weight divided by the number of tweets in the row."""
+        tweets = self.tweets[self._rows[name]] if name in self._rows else 0
+        return {word: w / tweets for word, (_, w) in self.row(name).items()} if tweets else {}
+
+    def diff(self, name, other_name=None, other=None, k=10):
+        """Return the k words whose weight per tweet differs most between the
+        named row and other_name in other, as (word, difference) pairs.
+
+        other -- another matrix, such as one of a different time window;
+                 by default this matrix
+        other_name -- a row of other; by default, name
+        """
+        mine = self.weight_per_tweet(name)
+        theirs = (other or self).weight_per_tweet(other_name or name)
+        differences = ((word, mine.get(word, 0) - theirs.get(word, 0))
+                       for word in set(mine) | set(theirs))
+        return heapq.nlargest(k, differences, key=lambda pair: (abs(pair[1]), pair[0]))